@@ -1,12 +1,46 @@
+from . import controllers
 from . import models
 from . import wizard
 
 import logging
+import time
+from contextlib import contextmanager
+
 from odoo import api, SUPERUSER_ID
+from odoo.tools import config, str2bool
 
 _logger = logging.getLogger(__name__)
 
 
+def table_exists(cr, table_name):
+    cr.execute(
+        """
+        SELECT EXISTS (
+            SELECT FROM information_schema.tables
+            WHERE  table_schema = 'public'
+            AND    table_name   = %s
+        );
+        """,
+        (table_name,),
+    )
+    return cr.fetchone()[0] or False
+
+
+def column_exists(cr, table_name, column_name):
+    cr.execute(
+        """
+        SELECT EXISTS(
+            SELECT
+            FROM information_schema.columns
+            WHERE table_name = %s
+            AND column_name = %s
+        );
+        """,
+        (table_name, column_name),
+    )
+    return cr.fetchone()[0] or False
+
+
 def get_document_type_dict(env):
     return {
         "01": env.ref("l10n_do_accounting.ncf_fiscal_client").id,
@@ -25,6 +59,235 @@ def get_document_type_dict(env):
     }
 
 
+# Moves are migrated by id ranges of this size, one UPDATE statement per range
+MIGRATION_CHUNK_SIZE = 50000
+
+# Set-based counterpart of the v12 reference -> document type key mapping:
+#   ref[1:3] if len(ref) in (11, 13) else ref[9:-8]
+NCF_DOCUMENT_TYPE_KEY = """(
+    CASE WHEN length({ref}) IN (11, 13)
+    THEN substr({ref}, 2, 2)
+    ELSE substr({ref}, 10, greatest(length({ref}) - 17, 0))
+    END
+)"""
+
+# The key -> document type mapping itself is joined from the unnest() of
+# get_document_type_dict()
+INVOICE_MIGRATION_QUERY = """
+    UPDATE account_move AS am
+    SET ref = src.ref,
+        l10n_latam_document_type_id = {document_type},
+        {type_field} = src.{legacy_type_field},
+        l10n_do_cancellation_type = src.anulation_type,
+        l10n_do_origin_ncf = src.origin_out
+    FROM (
+        SELECT
+        ai.move_name, {ref} AS ref, ai.{legacy_type_field},
+        ai.anulation_type, ai.origin_out
+        FROM account_invoice AS ai
+        WHERE ai.state != 'draft'
+        AND ai.company_id = %(company_id)s
+    ) AS src
+    LEFT JOIN unnest(%(codes)s::varchar[], %(document_type_ids)s::int[])
+        AS dt(code, document_type_id)
+    ON dt.code = {document_type_key}
+    WHERE src.move_name = am.name
+    AND am.journal_id = %(journal_id)s
+    AND am.company_id = %(company_id)s
+    AND am.l10n_latam_document_type_id IS NULL
+    AND am.id BETWEEN %(min_id)s AND %(max_id)s
+    {extra_where}
+"""
+
+
+def get_legacy_reference_sql(purchase=False):
+    """Return the SQL expression of the v13 ref of an account_invoice (ai) row"""
+    if purchase:
+        return "replace(btrim(ai.reference, E' \\t\\r\\n'), ' ', '')"
+    return "btrim(ai.reference, E' \\t\\r\\n')"
+
+
+def get_invoice_migration_query(purchase=False):
+    """Return the UPDATE ... FROM account_invoice statement used to migrate a
+    range of sale (or purchase) moves of a journal"""
+    document_type_key = NCF_DOCUMENT_TYPE_KEY.format(ref="src.ref")
+    if not purchase:
+        return INVOICE_MIGRATION_QUERY.format(
+            document_type="dt.document_type_id",
+            document_type_key=document_type_key,
+            type_field="l10n_do_income_type",
+            legacy_type_field="income_type",
+            ref=get_legacy_reference_sql(),
+            extra_where="",
+        )
+    # Here we force a document type because database has shitty data and
+    # can't automatically determine one
+    return INVOICE_MIGRATION_QUERY.format(
+        document_type="""COALESCE(
+            dt.document_type_id,
+            CASE WHEN am.type = 'in_invoice'
+            THEN %(fiscal_type_id)s
+            ELSE %(credit_note_type_id)s
+            END
+        )""",
+        document_type_key=document_type_key,
+        type_field="l10n_do_expense_type",
+        legacy_type_field="expense_type",
+        ref=get_legacy_reference_sql(purchase=True),
+        extra_where="AND src.ref IS NOT NULL AND src.ref != ''",
+    )
+
+
+def get_journal_pending_moves_range(cr, company_id, journal_id):
+    """Return the (min, max) ids of the journal moves that haven't been
+    migrated yet"""
+    cr.execute(
+        """
+        SELECT MIN(id), MAX(id)
+        FROM account_move
+        WHERE journal_id = %s
+        AND company_id = %s
+        AND l10n_latam_document_type_id IS NULL;
+        """,
+        (journal_id, company_id),
+    )
+    return cr.fetchone()
+
+
+def migrate_invoice_chunk(
+    cr, company_id, journal_id, document_type_dict, min_id, max_id, purchase=False
+):
+    """Migrate the account_invoice data of the journal moves whose id is
+    between min_id and max_id with a single statement. Return the number of
+    migrated moves."""
+    cr.execute(
+        get_invoice_migration_query(purchase=purchase),
+        {
+            "company_id": company_id,
+            "journal_id": journal_id,
+            "min_id": min_id,
+            "max_id": max_id,
+            "codes": list(document_type_dict.keys()),
+            "document_type_ids": list(document_type_dict.values()),
+            "fiscal_type_id": document_type_dict["01"],
+            "credit_note_type_id": document_type_dict["04"],
+        },
+    )
+    return cr.rowcount
+
+
+def migrate_journal_invoices(
+    cr,
+    company_id,
+    journal_id,
+    document_type_dict,
+    purchase=False,
+    chunk_size=None,
+    start_id=None,
+    checkpoint=None,
+):
+    """Migrate all the pending moves of a journal, chunk by chunk.
+
+    :param start_id: skip the moves below this id, used to resume a migration
+    :param checkpoint: callable receiving the last id of every migrated chunk
+    """
+    chunk_size = chunk_size or MIGRATION_CHUNK_SIZE
+    min_id, max_id = get_journal_pending_moves_range(cr, company_id, journal_id)
+    if min_id is None:
+        return 0
+    if start_id:
+        min_id = max(min_id, start_id)
+
+    migrated = 0
+    for chunk_start in range(min_id, max_id + 1, chunk_size):
+        chunk_end = min(chunk_start + chunk_size - 1, max_id)
+        migrated += migrate_invoice_chunk(
+            cr,
+            company_id,
+            journal_id,
+            document_type_dict,
+            chunk_start,
+            chunk_end,
+            purchase=purchase,
+        )
+        _logger.info(
+            "Migrated %s %s invoices of journal %s (ids up to %s of %s)"
+            % (
+                migrated,
+                "purchase" if purchase else "sale",
+                journal_id,
+                chunk_end,
+                max_id,
+            )
+        )
+        if checkpoint:
+            checkpoint(chunk_end)
+    return migrated
+
+
+def create_invoice_migration_index(cr):
+    """account_invoice.move_name is not indexed in v12, every migration
+    statement looks moves up by it"""
+    cr.execute(
+        """
+        CREATE INDEX IF NOT EXISTS account_invoice_l10n_do_migration_index
+        ON account_invoice (company_id, move_name)
+        WHERE state != 'draft';
+        """
+    )
+
+
+def get_migration_companies(env):
+    """Return the companies whose invoices are migrated from account_invoice"""
+    domain = [("country_id", "=", env.ref("base.do").id), ("vat", "!=", False)]
+    return env["res.company"].search(domain)
+
+
+def get_invoice_migration_journals(env, company):
+    """Return the sale journal and the purchase journals of a company whose
+    moves are migrated from account_invoice"""
+    sales_journal = (
+        env["account.move"]
+        .with_context(default_type="out_invoice", default_company_id=company.id)
+        ._get_default_journal()
+    )
+
+    env.cr.execute(
+        """
+    SELECT id FROM account_journal
+    WHERE purchase_type != 'others'
+    AND company_id = %s
+    """,
+        (company.id,),
+    )
+    purchase_journals = env["account.journal"].browse(
+        [i[0] for i in env.cr.fetchall()]
+    )
+    return sales_journal, purchase_journals
+
+
+def archive_deprecated_journals(env, company):
+    """
+    Archive deprecated journals.
+    purchase_type in (minor, informal, exterior).
+    In v13 all purchase are supposed to use an unique journal which handle
+    all fiscal sequences.
+    """
+    env.cr.execute(
+        """
+    SELECT id FROM account_journal
+    WHERE type = 'purchase'
+    AND purchase_type != 'normal'
+    AND company_id = %s
+    """,
+        (company.id,),
+    )
+
+    env["account.journal"].browse([i[0] for i in env.cr.fetchall()]).write(
+        {"active": False}
+    )
+
+
 def migrate_invoice_fields(env):
     """
     account_invoice  ---->  account_move
@@ -34,280 +297,242 @@ def migrate_invoice_fields(env):
     expense_type            l10n_do_expense_type
     anulation_type          l10n_do_cancellation_type
     origin_out              l10n_do_origin_ncf
+
+    Data is migrated with UPDATE ... FROM account_invoice statements over
+    ranges of MIGRATION_CHUNK_SIZE moves instead of row by row.
     """
-    env.cr.execute(
-        """
-        SELECT EXISTS (
-            SELECT FROM information_schema.tables
-            WHERE  table_schema = 'public'
-            AND    table_name   = 'account_invoice'
-        );
-        """
-    )
 
     # if account_invoice table exist
-    if env.cr.fetchone()[0] or False:
+    if table_exists(env.cr, "account_invoice"):
 
         _logger.info("Starting data migration from account_invoice to account_move")
 
         document_type_dict = get_document_type_dict(env)
+        create_invoice_migration_index(env.cr)
 
-        Move = env["account.move"]
-        domain = [("country_id", "=", env.ref("base.do").id), ("vat", "!=", False)]
-        for company in env["res.company"].search(domain):
+        for company in get_migration_companies(env):
+            sales_journal, purchase_journals = get_invoice_migration_journals(
+                env, company
+            )
 
             # Sale invoices routine
-            sales_journal = Move.with_context(
-                default_type="out_invoice", default_company_id=company.id
-            )._get_default_journal()
-
-            sale_invoices = Move.search(
-                [
-                    ("journal_id", "=", sales_journal.id),
-                    ("company_id", "=", company.id),
-                    ("l10n_latam_document_type_id", "=", False),
-                ]
+            migrate_journal_invoices(
+                env.cr, company.id, sales_journal.id, document_type_dict
             )
-            sale_invoices_len = len(sale_invoices)
-
-            for i, invoice in enumerate(sale_invoices):
-                query = """
-                    SELECT
-                    reference, income_type, anulation_type, origin_out
-                    FROM account_invoice
-                    WHERE move_name = '%s'
-                    AND state != 'draft'
-                    AND company_id = %s;
-                    """
-                env.cr.execute(query % invoice.name, company.id)
-                data = env.cr.fetchone()
-                if data:
-                    _logger.info(
-                        "Migrating data for sale invoice %s - %s of %s"
-                        % (data[0], i, sale_invoices_len)
-                    )
-
-                    ref = data[0].strip()
-                    document_type_key = ref[1:3] if len(ref) in (11, 13) else ref[9:-8]
-                    try:
-                        document_type_id = document_type_dict[document_type_key]
-                    except KeyError:
-                        document_type_id = False
-
-                    invoice._write(
-                        {
-                            "ref": ref,
-                            "l10n_latam_document_type_id": document_type_id,
-                            "l10n_do_income_type": data[1],
-                            "l10n_do_cancellation_type": data[2],
-                            "l10n_do_origin_ncf": data[3],
-                        }
-                    )
-
             sales_journal._write({"l10n_latam_use_documents": True})
 
             # Purchase invoices routine
-            env.cr.execute(
-                """
-            SELECT id FROM account_journal
-            WHERE purchase_type != 'others'
-            AND company_id = %s
-            """
-                % company.id
-            )
-
-            purchase_journals = env["account.journal"].browse(
-                [i[0] for i in env.cr.fetchall()]
-            )
             for journal in purchase_journals:
-
-                purchase_invoices = Move.search(
-                    [
-                        ("journal_id", "=", journal.id),
-                        ("company_id", "=", company.id),
-                        ("l10n_latam_document_type_id", "=", False),
-                    ]
+                migrate_journal_invoices(
+                    env.cr, company.id, journal.id, document_type_dict, purchase=True
                 )
-                purchase_invoices_len = len(purchase_invoices)
-
-                for i, invoice in enumerate(purchase_invoices):
-                    query = """
-                        SELECT
-                        reference, expense_type, anulation_type, origin_out
-                        FROM account_invoice
-                        WHERE move_name = '%s'
-                        AND state != 'draft'
-                        AND company_id = %s;
-                        """
-                    env.cr.execute(query % invoice.name, company.id)
-                    data = env.cr.fetchone()
-                    if data:
-                        _logger.info(
-                            "Migrating data for purchase invoice %s - %s of %s"
-                            % (data[0], i, purchase_invoices_len)
-                        )
-
-                        ref = (
-                            data[0].strip().replace(" ", "")
-                            if data[0] is not None
-                            else ""
-                        )
-                        if ref:
-                            document_type_key = (
-                                ref[1:3] if len(ref) in (11, 13) else ref[9:-8]
-                            )
-                            try:
-                                document_type_id = document_type_dict[document_type_key]
-                            except KeyError:
-                                # Here we force a document type because database has
-                                # shitty data and can't automatically determine one
-                                document_type_id = (
-                                    document_type_dict["01"]
-                                    if invoice.type == "in_invoice"
-                                    else document_type_dict["04"]
-                                )
-                        else:
-                            continue
-
-                        invoice._write(
-                            {
-                                "ref": ref,
-                                "l10n_latam_document_type_id": document_type_id,
-                                "l10n_do_expense_type": data[1],
-                                "l10n_do_cancellation_type": data[2],
-                                "l10n_do_origin_ncf": data[3],
-                            }
-                        )
-
                 journal._write({"l10n_latam_use_documents": True})
 
-            # Archive deprecated journals.
-            # purchase_type in (minor, informal, exterior).
-            # In v13 all purchase are supposed to use an unique journal which handle
-            # all fiscal sequences.
-            env.cr.execute(
+            archive_deprecated_journals(env, company)
+
+        # moves have been updated behind the ORM back
+        env["account.move"].invalidate_cache()
+
+
+# v12 ir_sequence_date_range.sale_fiscal_type -> document type key
+SALE_FISCAL_TYPE_DICT = {
+    "minor": "13",
+    "exterior": "17",
+    "credit_note": "04",
+    "debit_note": "03",
+    "final": "02",
+    "unico": "12",
+    "gov": "15",
+    "special": "14",
+    "fiscal": "01",
+    "informal": "11",
+}
+
+
+@contextmanager
+def log_duration(step):
+    """Log how long the wrapped migration step took"""
+    start = time.time()
+    yield
+    _logger.info("%s took %.3fs" % (step, time.time() - start))
+
+
+def get_company_sequence_index(env, company_id):
+    """Return a {document_type_id: [(sequence_id, number_next, updatable)]}
+    index of the active fiscal sequences of a company. Sequences that are not
+    updatable with SQL (standard implementation or date ranges) don't keep
+    their next number in ir_sequence.number_next, it is read through the ORM
+    and they must be written through it too"""
+    cr = env.cr
+    cr.execute(
+        """
+        SELECT seq.l10n_latam_document_type_id, seq.id, seq.number_next,
+        seq.implementation = 'no_gap' AND NOT seq.use_date_range
+        FROM ir_sequence AS seq
+        JOIN account_journal AS aj
+        ON (seq.l10n_latam_journal_id = aj.id)
+        WHERE aj.l10n_latam_use_documents
+        AND aj.active
+        AND seq.active
+        AND aj.company_id = %s
+        AND seq.l10n_latam_document_type_id IS NOT NULL
+        ORDER BY seq.name, seq.id;
+        """,
+        (company_id,),
+    )
+    rows = cr.fetchall()
+    # (document_type_id, sequence_id, number_next, updatable) rows
+    orm_sequences = env["ir.sequence"].browse([row[1] for row in rows if not row[3]])
+    number_next_actual = {seq.id: seq.number_next_actual for seq in orm_sequences}
+
+    index = {}
+    for document_type_id, sequence_id, number_next, updatable in rows:
+        if not updatable:
+            number_next = number_next_actual[sequence_id]
+        index.setdefault(document_type_id, []).append(
+            (sequence_id, number_next, updatable)
+        )
+    return index
+
+
+def get_company_legacy_number_next(cr, company_id):
+    """Return the highest v12 number_next of a company by document type key"""
+    cr.execute(
+        """
+        SELECT dr.sale_fiscal_type, MAX(dr.number_next)
+        FROM ir_sequence_date_range AS dr
+        JOIN ir_sequence AS seq
+        ON (dr.sequence_id = seq.id)
+        WHERE dr.sale_fiscal_type IS NOT NULL
+        AND seq.company_id = %s
+        GROUP BY dr.sale_fiscal_type;
+        """,
+        (company_id,),
+    )
+    return {
+        SALE_FISCAL_TYPE_DICT[fiscal_type]: number_next
+        for fiscal_type, number_next in cr.fetchall()
+        if fiscal_type in SALE_FISCAL_TYPE_DICT
+    }
+
+
+def migrate_company_fiscal_sequences(env, company, document_type_dict=None):
+    """Migrate the v12 fiscal sequences of a company. Every sequence lower than
+    its v12 counterpart is updated at once"""
+    document_type_dict = document_type_dict or get_document_type_dict(env)
+    cr = env.cr
+
+    with log_duration("Company %s fiscal sequences index" % company.id):
+        sequence_index = get_company_sequence_index(env, company.id)
+        legacy_number_next = get_company_legacy_number_next(cr, company.id)
+
+    sql_updates = {}
+    orm_updates = {}
+    for document_type_key, number_next in legacy_number_next.items():
+        document_type_id = document_type_dict.get(document_type_key)
+        for sequence_id, current_next, updatable in sequence_index.get(
+            document_type_id, []
+        ):
+            if current_next < number_next:
+                updates = sql_updates if updatable else orm_updates
+                updates[sequence_id] = number_next
+
+    with log_duration("Company %s fiscal sequences update" % company.id):
+        if sql_updates:
+            cr.execute(
                 """
-            SELECT id FROM account_journal
-            WHERE type = 'purchase'
-            AND purchase_type != 'normal'
-            AND company_id = %s
-            """
-                % company.id
+                UPDATE ir_sequence AS seq
+                SET number_next = v.number_next
+                FROM unnest(%s::int[], %s::int[]) AS v(id, number_next)
+                WHERE seq.id = v.id;
+                """,
+                (list(sql_updates.keys()), list(sql_updates.values())),
             )
-
-            env["account.journal"].browse([i[0] for i in env.cr.fetchall()]).write(
-                {"active": False}
+            env["ir.sequence"].invalidate_cache(
+                ["number_next", "number_next_actual"], list(sql_updates.keys())
+            )
+        for sequence_id, number_next in orm_updates.items():
+            env["ir.sequence"].browse(sequence_id).write(
+                {"number_next_actual": number_next}
             )
 
+    _logger.info(
+        "Company %s: %s fiscal sequences migrated"
+        % (company.id, len(sql_updates) + len(orm_updates))
+    )
+
 
 def migrate_fiscal_sequences(env):
     """
     ir_sequence_date_range   ---->  ir_sequence
     number_next                     number_next_actual
     """
-    env.cr.execute(
-        """
-        SELECT EXISTS(
-            SELECT
-            FROM information_schema.columns
-            WHERE table_name = 'ir_sequence_date_range'
-            AND column_name = 'sale_fiscal_type'
-        );
-        """
-    )
 
     # if ir_sequence_date_range table has sale_fiscal_type column
-    if env.cr.fetchone()[0] or False:
+    if column_exists(env.cr, "ir_sequence_date_range", "sale_fiscal_type"):
         _logger.info(
             "Starting data migration from ir_sequence_date_range to ir_sequence"
         )
-        domain = [("country_id", "=", env.ref("base.do").id)]
-        for company in env["res.company"].search(domain):
-
-            fiscal_journals = env["account.journal"].search(
-                [
-                    ("l10n_latam_use_documents", "=", True),
-                    ("company_id", "=", company.id),
-                ]
-            )
-
-            fiscal_sequences = env["ir.sequence"].search(
-                [("l10n_latam_journal_id", "in", fiscal_journals.ids)]
-            )
-
-            sale_fiscal_type_dict = {
-                "minor": "13",
-                "exterior": "17",
-                "credit_note": "04",
-                "debit_note": "03",
-                "final": "02",
-                "unico": "12",
-                "gov": "15",
-                "special": "14",
-                "fiscal": "01",
-                "informal": "11",
-            }
-
-            env.cr.execute(
-                """
-                SELECT dr.sale_fiscal_type, dr.number_next
-                FROM ir_sequence_date_range AS dr
-                JOIN ir_sequence AS seq
-                ON (dr.sequence_id = seq.id)
-                WHERE dr.sale_fiscal_type IS NOT NULL
-                AND seq.company_id = %s;
-                """
-                % company.id
-            )
-
-            for fiscal_type, number_next in env.cr.fetchall():
-
-                sequence_ids = fiscal_sequences.filtered(
-                    lambda fs: fs.l10n_latam_document_type_id.id
-                    == dict(get_document_type_dict(env))[
-                        sale_fiscal_type_dict[fiscal_type]
-                    ]
-                )
-                if sequence_ids and sequence_ids[0].number_next_actual < number_next:
-                    _logger.info(
-                        "Setting up %s number_next_actual" % sequence_ids[0].name
-                    )
-                    sequence_ids.write({"number_next_actual": number_next})
+        with log_duration("Fiscal sequences migration"):
+            document_type_dict = get_document_type_dict(env)
+            domain = [("country_id", "=", env.ref("base.do").id)]
+            for company in env["res.company"].search(domain):
+                migrate_company_fiscal_sequences(env, company, document_type_dict)
 
 
-def migrate_partner_fields(env):
+def migrate_partner_fields(env, chunk_size=None, start_id=None, checkpoint=None):
     """
     expense_type ---> l10n_do_expense_type
+
+    The column is copied by id ranges of chunk_size partners, one statement
+    per range, afterwards only the fields depending on l10n_do_expense_type of
+    the updated partners are recomputed.
+
+    :param start_id: skip the partners below this id, used to resume a migration
+    :param checkpoint: callable receiving the last id of every migrated range
     """
-    env.cr.execute(
-        """
-        SELECT EXISTS(
-            SELECT
-            FROM information_schema.columns
-            WHERE table_name = 'res_partner'
-            AND column_name = 'expense_type'
-        );
-        """
-    )
 
     # if res_partner table has expense_type column
-    if env.cr.fetchone()[0] or False:
+    if column_exists(env.cr, "res_partner", "expense_type"):
         _logger.info("Starting partner fields migration")
-        env.cr.execute(
-            """
-            SELECT id, expense_type
-            FROM res_partner
-            WHERE l10n_do_expense_type IS NULL
-            AND expense_type IS NOT NULL;
-            """
-        )
-        for i, expense_type in env.cr.fetchall():
-            partner_id = env["res.partner"].browse(i)
-            _logger.info(
-                "Setting up %s l10n_do_expense_type = %s"
-                % (partner_id.name, expense_type)
-            )
-            partner_id.write({"l10n_do_expense_type": expense_type})
+        chunk_size = chunk_size or MIGRATION_CHUNK_SIZE
+        env.cr.execute("SELECT MIN(id), MAX(id) FROM res_partner")
+        min_id, max_id = env.cr.fetchone()
+        if min_id is None:
+            return
+        if start_id:
+            min_id = max(min_id, start_id)
+
+        Partner = env["res.partner"]
+        with log_duration("Partner fields migration"):
+            migrated = 0
+            for chunk_start in range(min_id, max_id + 1, chunk_size):
+                chunk_end = min(chunk_start + chunk_size - 1, max_id)
+                env.cr.execute(
+                    """
+                    UPDATE res_partner
+                    SET l10n_do_expense_type = expense_type
+                    WHERE l10n_do_expense_type IS NULL
+                    AND expense_type IS NOT NULL
+                    AND id BETWEEN %s AND %s
+                    RETURNING id;
+                    """,
+                    (chunk_start, chunk_end),
+                )
+                partner_ids = [i[0] for i in env.cr.fetchall()]
+                if partner_ids:
+                    Partner.invalidate_cache(["l10n_do_expense_type"], partner_ids)
+                    partners = Partner.browse(partner_ids)
+                    partners.modified(["l10n_do_expense_type"])
+                    partners.flush()
+                    Partner.invalidate_cache(ids=partner_ids)
+                migrated += len(partner_ids)
+                _logger.info(
+                    "Set up %s partners l10n_do_expense_type (ids up to %s of %s)"
+                    % (migrated, chunk_end, max_id)
+                )
+                if checkpoint:
+                    checkpoint(chunk_end)
 
 
 def post_init_hook(cr, registry):
@@ -317,10 +542,30 @@ def post_init_hook(cr, registry):
 
     Notice: this script won't convert your v12 database to a v13 one. This script
     only works if your database have been migrated by Odoo
+
+    On big databases set l10n_do_accounting_deferred_migration = True in the
+    server configuration file and run migration.run_migration() once the module
+    is installed, it commits every chunk and can be resumed. Setting
+    l10n_do_accounting_migration_dry_run = True reports what would be migrated
+    and the projected duration instead.
     """
 
     env = api.Environment(cr, SUPERUSER_ID, {})
 
+    if str2bool(config.get("l10n_do_accounting_migration_dry_run") or "0"):
+        from .migration import dry_run_migration
+
+        dry_run_migration(env)
+        return
+
+    if str2bool(config.get("l10n_do_accounting_deferred_migration") or "0"):
+        _logger.info(
+            "Data migration deferred, run "
+            "odoo.addons.l10n_do_accounting.migration.run_migration()"
+        )
+        return
+
     migrate_invoice_fields(env)
     migrate_fiscal_sequences(env)
     migrate_partner_fields(env)
+    env["l10n_do.fiscal.summary"].rebuild()
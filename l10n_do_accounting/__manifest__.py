@@ -14,14 +14,19 @@
     # always loaded
     "data": [
         "security/res_groups.xml",
+        "security/ir.model.access.csv",
         "data/l10n_latam.document.type.csv",
+        "data/ir_cron.xml",
         "wizard/account_move_reversal_views.xml",
         "wizard/account_move_cancel_views.xml",
+        "wizard/vendor_bill_import_views.xml",
+        "wizard/dgii_report_views.xml",
         "views/res_config_settings_view.xml",
         "views/account_move_views.xml",
         "views/res_partner_views.xml",
         "views/res_company_views.xml",
         "views/account_dgii_menuitem.xml",
+        "views/l10n_do_fiscal_summary_views.xml",
         "views/account_journal_views.xml",
         "views/l10n_latam_document_type_views.xml",
         "views/report_templates.xml",
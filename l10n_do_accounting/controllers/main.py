@@ -0,0 +1,23 @@
+import os
+
+from odoo import http
+from odoo.http import request
+
+
+class DgiiReportController(http.Controller):
+    @http.route(
+        "/l10n_do_accounting/dgii_report/<int:report_id>", type="http", auth="user"
+    )
+    def dgii_report_download(self, report_id, **kwargs):
+        """Stream the file of a generated DGII report from disk"""
+        report = request.env["l10n_do.dgii.report"].browse(report_id).exists()
+        if not report:
+            return request.not_found()
+        report.check_access_rights("read")
+        report.check_access_rule("read")
+        path = report._get_report_path()
+        if report.state != "done" or not os.path.isfile(path):
+            return request.not_found()
+        return http.send_file(
+            path, filename=report.filename, as_attachment=True, cache_timeout=0
+        )
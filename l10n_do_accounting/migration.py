@@ -0,0 +1,417 @@
+"""
+Resumable runner of the v12 ncf_manager data migration.
+
+The post_init_hook migrates the whole database in the module installation
+transaction. On big databases set l10n_do_accounting_deferred_migration = True
+in the server configuration file, install the module and then run, i.e. from
+odoo shell:
+
+    from odoo.addons.l10n_do_accounting.migration import run_migration
+    run_migration(env.cr.dbname)
+
+Moves are migrated by id ranges and every chunk is committed along with its
+checkpoint in l10n_do_migration_checkpoint, so an interrupted run resumes where
+it stopped. To spread the companies over several processes start one odoo shell
+per worker, each one running i.e. run_migration(env.cr.dbname, worker=1,
+workers=4), so every process opens its own database connections.
+
+dry_run_migration() (or l10n_do_accounting_migration_dry_run = True on
+installation) doesn't migrate anything, it reports the rows every phase would
+migrate and how long it would take from a sample of rows migrated inside a
+savepoint that is rolled back.
+"""
+import logging
+import time
+
+import odoo
+from odoo import api, SUPERUSER_ID
+
+from . import (
+    MIGRATION_CHUNK_SIZE,
+    NCF_DOCUMENT_TYPE_KEY,
+    archive_deprecated_journals,
+    column_exists,
+    create_invoice_migration_index,
+    get_document_type_dict,
+    get_invoice_migration_journals,
+    get_journal_pending_moves_range,
+    get_legacy_reference_sql,
+    get_migration_companies,
+    migrate_company_fiscal_sequences,
+    migrate_invoice_chunk,
+    migrate_journal_invoices,
+    migrate_partner_fields,
+    table_exists,
+)
+
+_logger = logging.getLogger(__name__)
+
+def create_checkpoint_table(cr):
+    cr.execute(
+        """
+        CREATE TABLE IF NOT EXISTS l10n_do_migration_checkpoint (
+            phase VARCHAR NOT NULL,
+            company_id INTEGER NOT NULL DEFAULT 0,
+            journal_id INTEGER NOT NULL DEFAULT 0,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            done BOOLEAN NOT NULL DEFAULT FALSE,
+            write_date TIMESTAMP NOT NULL DEFAULT (now() at time zone 'UTC'),
+            PRIMARY KEY (phase, company_id, journal_id)
+        );
+        """
+    )
+
+
+def get_checkpoint(cr, phase, company_id=0, journal_id=0):
+    """Return the (last_id, done) checkpoint of a migration phase"""
+    cr.execute(
+        """
+        SELECT last_id, done
+        FROM l10n_do_migration_checkpoint
+        WHERE phase = %s
+        AND company_id = %s
+        AND journal_id = %s;
+        """,
+        (phase, company_id, journal_id),
+    )
+    return cr.fetchone() or (0, False)
+
+
+def set_checkpoint(cr, phase, company_id=0, journal_id=0, last_id=0, done=False):
+    """Save a migration phase checkpoint and commit the work done so far"""
+    cr.execute(
+        """
+        INSERT INTO l10n_do_migration_checkpoint
+        (phase, company_id, journal_id, last_id, done)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (phase, company_id, journal_id)
+        DO UPDATE SET
+            last_id = EXCLUDED.last_id,
+            done = EXCLUDED.done,
+            write_date = (now() at time zone 'UTC');
+        """,
+        (phase, company_id, journal_id, last_id, done),
+    )
+    cr.commit()
+
+
+def migrate_company(env, company, chunk_size=None):
+    """Run every per company migration phase that isn't done yet"""
+    cr = env.cr
+    document_type_dict = get_document_type_dict(env)
+
+    if company.vat and table_exists(cr, "account_invoice"):
+        sales_journal, purchase_journals = get_invoice_migration_journals(
+            env, company
+        )
+        journals = [(sales_journal, False)] + [(j, True) for j in purchase_journals]
+
+        for journal, purchase in journals:
+            last_id, done = get_checkpoint(cr, "invoices", company.id, journal.id)
+            if done:
+                continue
+
+            def checkpoint(chunk_end, journal_id=journal.id):
+                set_checkpoint(cr, "invoices", company.id, journal_id, chunk_end)
+
+            migrate_journal_invoices(
+                cr,
+                company.id,
+                journal.id,
+                document_type_dict,
+                purchase=purchase,
+                chunk_size=chunk_size,
+                start_id=last_id + 1,
+                checkpoint=checkpoint,
+            )
+            journal._write({"l10n_latam_use_documents": True})
+            set_checkpoint(cr, "invoices", company.id, journal.id, done=True)
+
+        if not get_checkpoint(cr, "journals", company.id)[1]:
+            archive_deprecated_journals(env, company)
+            set_checkpoint(cr, "journals", company.id, done=True)
+
+        env["account.move"].invalidate_cache()
+
+    if column_exists(cr, "ir_sequence_date_range", "sale_fiscal_type"):
+        if not get_checkpoint(cr, "sequences", company.id)[1]:
+            migrate_company_fiscal_sequences(env, company, document_type_dict)
+            set_checkpoint(cr, "sequences", company.id, done=True)
+
+
+def run_migration(dbname, chunk_size=None, worker=0, workers=1):
+    """
+    Migrate the v12 ncf_manager data of a database committing every chunk.
+    Can be run again after an interruption, finished phases are skipped.
+
+    :param dbname: database to migrate
+    :param chunk_size: number of moves migrated per transaction
+    :param worker: index of this process, from 0 to workers - 1
+    :param workers: number of processes the companies are spread over. The
+        partners phase is run by worker 0
+    """
+    chunk_size = chunk_size or MIGRATION_CHUNK_SIZE
+    registry = odoo.registry(dbname)
+
+    with api.Environment.manage(), registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        create_checkpoint_table(cr)
+        if table_exists(cr, "account_invoice"):
+            create_invoice_migration_index(cr)
+        cr.commit()
+        companies = env["res.company"].search(
+            [("country_id", "=", env.ref("base.do").id)], order="id"
+        )
+        companies = companies.browse(companies.ids[worker::workers])
+
+        for company in companies:
+            migrate_company(env, company, chunk_size)
+            _logger.info("Data migration of company %s done" % company.id)
+
+        last_id, done = get_checkpoint(cr, "partners")
+        if not worker and not done:
+
+            def checkpoint(chunk_end):
+                set_checkpoint(cr, "partners", last_id=chunk_end)
+
+            migrate_partner_fields(
+                env, chunk_size, start_id=last_id + 1, checkpoint=checkpoint
+            )
+            set_checkpoint(cr, "partners", done=True)
+
+        # Invoices are migrated with SQL
+        if companies:
+            env["l10n_do.fiscal.summary"].rebuild(companies)
+        cr.commit()
+
+
+def rolled_back(cr, func, *args):
+    """Run func inside a savepoint that is rolled back afterwards.
+    Return its result and how long it took."""
+    cr.execute("SAVEPOINT l10n_do_migration_dry_run")
+    try:
+        start = time.time()
+        res = func(*args)
+        elapsed = time.time() - start
+    finally:
+        cr.execute("ROLLBACK TO SAVEPOINT l10n_do_migration_dry_run")
+    return res, elapsed
+
+
+def get_journal_migration_stats(
+    cr, company_id, journal_id, document_type_dict, purchase=False
+):
+    """Return the number of pending moves of a journal, how many of them would
+    be migrated and a {document type key: count} dict of the NCF keys without
+    document type. Sale moves keep an empty document type for those keys,
+    purchase ones are forced to "01"/"04"."""
+    cr.execute(
+        """
+        SELECT COUNT(*)
+        FROM account_move
+        WHERE journal_id = %s
+        AND company_id = %s
+        AND l10n_latam_document_type_id IS NULL;
+        """,
+        (journal_id, company_id),
+    )
+    pending = cr.fetchone()[0]
+
+    cr.execute(
+        """
+        SELECT {document_type_key} AS code, COUNT(*)
+        FROM (
+            SELECT {ref} AS ref
+            FROM account_move AS am
+            JOIN account_invoice AS ai
+            ON (ai.move_name = am.name)
+            WHERE ai.state != 'draft'
+            AND ai.company_id = %(company_id)s
+            AND am.journal_id = %(journal_id)s
+            AND am.company_id = %(company_id)s
+            AND am.l10n_latam_document_type_id IS NULL
+        ) AS src
+        {where}
+        GROUP BY code;
+        """.format(
+            document_type_key=NCF_DOCUMENT_TYPE_KEY.format(ref="src.ref"),
+            ref=get_legacy_reference_sql(purchase=purchase),
+            where="WHERE src.ref IS NOT NULL AND src.ref != ''" if purchase else "",
+        ),
+        {"company_id": company_id, "journal_id": journal_id},
+    )
+    counts = dict(cr.fetchall())
+    unmapped = {
+        code: count for code, count in counts.items() if code not in document_type_dict
+    }
+    return pending, sum(counts.values()), unmapped
+
+
+def dry_run_migration(env, sample_size=1000):
+    """
+    Report the rows every migration phase would migrate, the projected
+    duration from the throughput measured on samples of sample_size rows and
+    the NCF document type keys that can't be mapped. Nothing is migrated, only
+    the account_invoice index the migration relies on is created so samples
+    are representative.
+
+    :return: dict with the report data
+    """
+    cr = env.cr
+    report = {"invoices": [], "sequences": [], "partners": 0, "projection": {}}
+    samples = {"sale": [0, 0.0], "purchase": [0, 0.0], "partners": [0, 0.0]}
+    document_type_dict = get_document_type_dict(env)
+
+    if table_exists(cr, "account_invoice"):
+        create_invoice_migration_index(cr)
+        for company in get_migration_companies(env):
+            sales_journal, purchase_journals = get_invoice_migration_journals(
+                env, company
+            )
+            journals = [(sales_journal, False)] + [
+                (j, True) for j in purchase_journals
+            ]
+            for journal, purchase in journals:
+                pending, to_migrate, unmapped = get_journal_migration_stats(
+                    cr, company.id, journal.id, document_type_dict, purchase
+                )
+                report["invoices"].append(
+                    {
+                        "company_id": company.id,
+                        "journal_id": journal.id,
+                        "purchase": purchase,
+                        "pending": pending,
+                        "to_migrate": to_migrate,
+                        "unmapped": unmapped,
+                    }
+                )
+
+                min_id, max_id = get_journal_pending_moves_range(
+                    cr, company.id, journal.id
+                )
+                if min_id is not None:
+                    rows, elapsed = rolled_back(
+                        cr,
+                        migrate_invoice_chunk,
+                        cr,
+                        company.id,
+                        journal.id,
+                        document_type_dict,
+                        min_id,
+                        min(min_id + sample_size - 1, max_id),
+                        purchase,
+                    )
+                    sample = samples["purchase" if purchase else "sale"]
+                    sample[0] += rows
+                    sample[1] += elapsed
+
+    sequences_elapsed = 0.0
+    if column_exists(cr, "ir_sequence_date_range", "sale_fiscal_type"):
+
+        def migrate_sequences(company):
+            migrate_company_fiscal_sequences(env, company, document_type_dict)
+            env["ir.sequence"].flush()
+
+        domain = [("country_id", "=", env.ref("base.do").id)]
+        for company in env["res.company"].search(domain):
+            cr.execute(
+                """
+                SELECT COUNT(*)
+                FROM ir_sequence_date_range AS dr
+                JOIN ir_sequence AS seq
+                ON (dr.sequence_id = seq.id)
+                WHERE dr.sale_fiscal_type IS NOT NULL
+                AND seq.company_id = %s;
+                """,
+                (company.id,),
+            )
+            report["sequences"].append(
+                {"company_id": company.id, "to_migrate": cr.fetchone()[0]}
+            )
+            sequences_elapsed += rolled_back(cr, migrate_sequences, company)[1]
+        env["ir.sequence"].invalidate_cache()
+
+    if column_exists(cr, "res_partner", "expense_type"):
+        cr.execute(
+            """
+            SELECT COUNT(*)
+            FROM res_partner
+            WHERE l10n_do_expense_type IS NULL
+            AND expense_type IS NOT NULL;
+            """
+        )
+        report["partners"] = cr.fetchone()[0]
+
+        def migrate_partners_sample():
+            cr.execute(
+                """
+                UPDATE res_partner
+                SET l10n_do_expense_type = expense_type
+                WHERE id IN (
+                    SELECT id FROM res_partner
+                    WHERE l10n_do_expense_type IS NULL
+                    AND expense_type IS NOT NULL
+                    LIMIT %s
+                );
+                """,
+                (sample_size,),
+            )
+            return cr.rowcount
+
+        samples["partners"] = list(rolled_back(cr, migrate_partners_sample))
+
+    def projection(rows, sample):
+        sampled_rows, elapsed = sample
+        if not rows or not sampled_rows:
+            return 0.0
+        return rows * elapsed / sampled_rows
+
+    for phase, purchase in (("sale", False), ("purchase", True)):
+        rows = sum(
+            line["to_migrate"]
+            for line in report["invoices"]
+            if line["purchase"] == purchase
+        )
+        report["projection"][phase] = (rows, projection(rows, samples[phase]))
+    report["projection"]["sequences"] = (
+        sum(line["to_migrate"] for line in report["sequences"]),
+        sequences_elapsed,
+    )
+    report["projection"]["partners"] = (
+        report["partners"],
+        projection(report["partners"], samples["partners"]),
+    )
+
+    log_dry_run_report(report)
+    return report
+
+
+def log_dry_run_report(report):
+    for line in report["invoices"]:
+        _logger.info(
+            "Company %(company_id)s journal %(journal_id)s: "
+            "%(to_migrate)s of %(pending)s pending moves to migrate" % line
+        )
+        for code, count in sorted(line["unmapped"].items(), key=lambda c: c[0] or ""):
+            _logger.warning(
+                "Company %s journal %s: %s moves with unmapped NCF type %r%s"
+                % (
+                    line["company_id"],
+                    line["journal_id"],
+                    count,
+                    code,
+                    ', forced to "01"/"04"' if line["purchase"] else "",
+                )
+            )
+    for line in report["sequences"]:
+        _logger.info(
+            "Company %(company_id)s: %(to_migrate)s fiscal sequences to migrate"
+            % line
+        )
+    total = 0.0
+    for phase, (rows, seconds) in report["projection"].items():
+        total += seconds
+        _logger.info(
+            "Migration phase %s: %s rows, projected %.1fs" % (phase, rows, seconds)
+        )
+    _logger.info("Projected migration duration: %.1fs" % total)
@@ -4,3 +4,7 @@ from . import l10n_latam_document_type
 from . import account_journal
 from . import account_move
 from . import account_move_line
+from . import l10n_do_ncf_block
+from . import ir_sequence
+from . import l10n_do_fiscal_summary
+from . import l10n_do_rnc_registry
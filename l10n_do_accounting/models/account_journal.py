@@ -1,4 +1,4 @@
-from odoo import fields, models, api, _
+from odoo import fields, models, api, tools, _
 from odoo.exceptions import RedirectWarning
 
 
@@ -33,13 +33,15 @@ class AccountJournal(models.Model):
         :param types_list: NCF list used to create fiscal sequences
         :return: types_list
         """
+        return self._l10n_do_add_ecf_ncf_types(
+            types_list,
+            self.company_id.l10n_do_ecf_issuer,
+            invoice and invoice.partner_id.l10n_do_dgii_tax_payer_type,
+        )
 
-        if self.company_id.l10n_do_ecf_issuer or (
-            invoice
-            and not self.company_id.l10n_do_ecf_issuer
-            and invoice.partner_id.l10n_do_dgii_tax_payer_type
-            and invoice.partner_id.l10n_do_dgii_tax_payer_type != "non_payer"
-        ):
+    @api.model
+    def _l10n_do_add_ecf_ncf_types(self, types_list, ecf_issuer, invoice_payer_type):
+        if ecf_issuer or (invoice_payer_type and invoice_payer_type != "non_payer"):
             types_list.extend(
                 ["e-%s" % d for d in types_list if d not in ("unique", "import")]
             )
@@ -76,13 +78,48 @@ class AccountJournal(models.Model):
         specific invoices to/from customer/supplier
         """
         self.ensure_one()
-        ncf_types_data = self._get_l10n_do_ncf_types_data()
 
         if not self.company_id.vat:
             action = self.env.ref("base.action_res_company_form")
             msg = _("Cannot create chart of account until you configure your VAT.")
             raise RedirectWarning(msg, action.id, _("Go to Companies"))
 
+        # Called on every invoice onchange, the result only depends on these values
+        return list(
+            self._get_l10n_do_journal_ncf_types(
+                self.id,
+                self.type,
+                invoice.type if invoice else None,
+                counterpart_partner.l10n_do_dgii_tax_payer_type
+                if counterpart_partner
+                else None,
+                self.company_id.l10n_do_ecf_issuer,
+                invoice.partner_id.l10n_do_dgii_tax_payer_type if invoice else None,
+            )
+        )
+
+    @api.model
+    @tools.ormcache(
+        "journal_id",
+        "journal_type",
+        "move_type",
+        "counterpart_payer_type",
+        "ecf_issuer",
+        "invoice_payer_type",
+    )
+    def _get_l10n_do_journal_ncf_types(
+        self,
+        journal_id,
+        journal_type,
+        move_type,
+        counterpart_payer_type,
+        ecf_issuer,
+        invoice_payer_type,
+    ):
+        """Cached by _get_journal_ncf_types(), cleared when journals, companies
+        or document types change. Return a tuple, so it can't be modified."""
+        ncf_types_data = self._get_l10n_do_ncf_types_data()
+
         # Get all the ncf_types values from the nested dictionary, remove duplicates and
         # convert it into a list
         ncf_types = list(
@@ -90,30 +127,34 @@ class AccountJournal(models.Model):
                 [
                     value
                     for dic in ncf_types_data[
-                        "issued" if self.type == "sale" else "received"
+                        "issued" if journal_type == "sale" else "received"
                     ].values()
                     for value in dic
                 ]
             )
         )
-        if not counterpart_partner:
+        if counterpart_payer_type is None:
             ncf_notes = list(["fiscal", "debit_note", "credit_note"])
             ncf_external = list(["fiscal", "special", "governmental"])
             res = (
                 ncf_types + ncf_notes
-                if self.type == "sale"
+                if journal_type == "sale"
                 else [ncf for ncf in ncf_types if ncf not in ncf_external]
             )
-            return self._get_all_ncf_types(res, invoice)
+            return tuple(
+                self._l10n_do_add_ecf_ncf_types(res, ecf_issuer, invoice_payer_type)
+            )
         else:
             counterpart_ncf_types = ncf_types_data[
-                "issued" if self.type == "sale" else "received"
-            ][counterpart_partner.l10n_do_dgii_tax_payer_type]
+                "issued" if journal_type == "sale" else "received"
+            ][counterpart_payer_type]
             ncf_types = list(set(ncf_types) & set(counterpart_ncf_types))
-        if invoice.type in ["out_refund", "in_refund"]:
+        if move_type in ["out_refund", "in_refund"]:
             ncf_types = ["credit_note"]
 
-        return self._get_all_ncf_types(ncf_types, invoice)
+        return tuple(
+            self._l10n_do_add_ecf_ncf_types(ncf_types, ecf_issuer, invoice_payer_type)
+        )
 
     def _get_journal_codes(self):
         self.ensure_one()
@@ -121,6 +162,30 @@ class AccountJournal(models.Model):
             return []
         return ["E"] if self.company_id.l10n_do_ecf_issuer else ["B"]
 
+    @tools.ormcache("self.id")
+    def _get_l10n_do_sequence_map(self):
+        """Return the active sequences of the journal by document type as
+        {document type id: tuple of sequence ids}. Cleared when the journal
+        sequences change, see _l10n_do_create_document_sequences()"""
+        self.ensure_one()
+        self.env["ir.sequence"].flush(
+            ["l10n_latam_journal_id", "l10n_latam_document_type_id", "active"]
+        )
+        self.env.cr.execute(
+            """
+            SELECT l10n_latam_document_type_id, array_agg(id ORDER BY id)
+            FROM ir_sequence
+            WHERE l10n_latam_journal_id = %s
+            AND active
+            GROUP BY l10n_latam_document_type_id;
+            """,
+            (self.id,),
+        )
+        return {
+            document_type_id or False: tuple(sequence_ids)
+            for document_type_id, sequence_ids in self.env.cr.fetchall()
+        }
+
     @api.model
     def create(self, values):
         """ Create Document sequences after create the journal """
@@ -132,6 +197,8 @@ class AccountJournal(models.Model):
         """ Update Document sequences after update journal """
         to_check = {"type", "l10n_latam_use_documents"}
         res = super().write(values)
+        if to_check.union({"company_id"}).intersection(set(values.keys())):
+            self.clear_caches()
         if to_check.intersection(set(values.keys())):
             for rec in self:
                 rec._l10n_do_create_document_sequences()
@@ -165,4 +232,5 @@ class AccountJournal(models.Model):
             sequences |= self.env["ir.sequence"].create(
                 document._get_document_sequence_vals(self)
             )
+        self.clear_caches()
         return sequences
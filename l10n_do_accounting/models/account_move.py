@@ -1,7 +1,89 @@
+import base64
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import psycopg2
+import pytz
 from werkzeug import urls
 
 from odoo import models, fields, api, _
 from odoo.exceptions import ValidationError, UserError, AccessError
+from odoo.tools import split_every
+
+_logger = logging.getLogger(__name__)
+
+L10N_DO_TZ = pytz.timezone("America/Santo_Domingo")
+
+# Invoices posted or cancelled between two flushes by l10n_do_batch_post() and
+# _l10n_do_cancel_invoices()
+L10N_DO_BATCH_CHUNK_SIZE = 500
+
+# Fields of posted and cancelled invoices l10n_do.fiscal.summary depends on,
+# state changes are tracked by post(), button_draft() and
+# _l10n_do_cancel_invoices()
+L10N_DO_SUMMARY_FIELDS = {
+    "company_id",
+    "journal_id",
+    "type",
+    "date",
+    "invoice_date",
+    "l10n_latam_document_type_id",
+    "l10n_do_income_type",
+    "l10n_do_expense_type",
+    "line_ids",
+    "invoice_line_ids",
+}
+
+ECF_STAMP_URL = (
+    "https://ecf.dgii.gov.do/%(ecf_service_env)s/ConsultaTimbre?"
+    "RncEmisor=%(issuer_vat)s&"
+    "%(buyer)s"
+    "ENCF=%(encf)s&"
+    "FechaEmision=%(issue_date)s&"
+    "MontoTotal=%(amount)s&"
+    "%(sign_date)s"
+    "CodigoSeguridad=%(security_code)s"
+)
+
+
+def get_l10n_do_electronic_stamp(
+    ecf_service_env,
+    issuer_vat,
+    buyer_vat,
+    encf,
+    issue_date,
+    amount,
+    security_code,
+    sign_date=False,
+):
+    """
+    Return the URL-encoded DGII e-CF stamp (the invoice QR code value)
+
+    :param buyer_vat: None on documents without buyer (Gasto Menor)
+    :param issue_date: date
+    :param amount: absolute invoice total
+    :param sign_date: UTC datetime, False when DGII doesn't want it
+    """
+    return urls.url_quote_plus(
+        ECF_STAMP_URL
+        % {
+            "ecf_service_env": ecf_service_env,
+            "issuer_vat": issuer_vat or "",
+            "buyer": "RncComprador=%s&" % buyer_vat if buyer_vat is not None else "",
+            "encf": encf or "",
+            "issue_date": issue_date.strftime("%d-%m-%Y"),
+            "amount": ("%f" % amount).rstrip("0").rstrip("."),
+            "sign_date": "FechaFirma=%s&"
+            % pytz.utc.localize(sign_date)
+            .astimezone(L10N_DO_TZ)
+            .strftime("%d-%m-%Y %H:%M:%S")
+            if sign_date
+            else "",
+            "security_code": security_code or "",
+        }
+    )
 
 
 class AccountMove(models.Model):
@@ -95,6 +177,13 @@ class AccountMove(models.Model):
         compute="_compute_l10n_do_electronic_stamp",
         store=True,
     )
+    l10n_do_electronic_stamp_qr = fields.Binary(
+        string="Electronic Stamp QR Code",
+        compute="_compute_l10n_do_electronic_stamp_qr",
+        store=True,
+        attachment=True,
+        copy=False,
+    )
     l10n_do_company_in_contingency = fields.Boolean(
         string="Company in contingency",
         compute="_compute_company_in_contingency",
@@ -140,71 +229,91 @@ class AccountMove(models.Model):
 
     @api.depends("company_id", "company_id.l10n_do_ecf_issuer")
     def _compute_company_in_contingency(self):
+        # A company is in contingency when it has issued e-CF but it is no longer
+        # an issuer. Search e-CF once per company, not once per invoice.
+        companies_in_contingency = {
+            company.id: bool(
+                self.search(
+                    [("is_ecf_invoice", "=", True), ("company_id", "=", company.id)],
+                    limit=1,
+                )
+            )
+            for company in self.mapped("company_id")
+            if not company.l10n_do_ecf_issuer
+        }
         for invoice in self:
-            ecf_invoices = self.search([("is_ecf_invoice", "=", True)], limit=1)
-            invoice.l10n_do_company_in_contingency = bool(
-                ecf_invoices and not invoice.company_id.l10n_do_ecf_issuer
+            invoice.l10n_do_company_in_contingency = companies_in_contingency.get(
+                invoice.company_id.id, False
             )
 
     @api.depends("l10n_do_ecf_security_code", "l10n_do_ecf_sign_date", "invoice_date")
     @api.depends_context("l10n_do_ecf_service_env")
     def _compute_l10n_do_electronic_stamp(self):
 
-        for invoice in self.filtered(
+        ecf_invoices = self.filtered(
             lambda i: i.is_ecf_invoice
             and i.l10n_do_ecf_security_code
             and i.l10n_do_ecf_sign_date
-        ):
+        )
+        if not ecf_invoices:
+            return
 
-            ecf_service_env = self.env.context.get("l10n_do_ecf_service_env", "CerteCF")
-            doc_code_prefix = invoice.l10n_latam_document_type_id.doc_code_prefix
-            has_sign_date = doc_code_prefix != "E32" or (
-                doc_code_prefix == "E32" and invoice.amount_total_signed >= 250000
-            )
+        ecf_service_env = self.env.context.get("l10n_do_ecf_service_env", "CerteCF")
+        today = fields.Date.today()
 
-            qr_string = "https://ecf.dgii.gov.do/%s/ConsultaTimbre?" % ecf_service_env
-            qr_string += "RncEmisor=%s&" % invoice.company_id.vat or ""
-            qr_string += (
-                "RncComprador=%s&" % invoice.commercial_partner_id.vat
-                if invoice.l10n_latam_document_type_id.doc_code_prefix[1:] != "43"
-                else invoice.company_id.vat
-            )
-            qr_string += "ENCF=%s&" % invoice.ref or ""
-            qr_string += "FechaEmision=%s&" % (
-                invoice.invoice_date or fields.Date.today()
-            ).strftime("%d-%m-%Y")
-            qr_string += "MontoTotal=%s&" % (
-                "%f" % abs(invoice.amount_total_signed)
-            ).rstrip("0").rstrip(".")
+        # Load the related fields of the whole batch at once
+        ecf_invoices.mapped("company_id.vat")
+        ecf_invoices.mapped("commercial_partner_id.vat")
+        ecf_invoices.mapped("l10n_latam_document_type_id.doc_code_prefix")
+
+        for invoice in ecf_invoices:
+            doc_code_prefix = invoice.l10n_latam_document_type_id.doc_code_prefix
+            amount_total = abs(invoice.amount_total_signed)
 
             # DGII doesn't want FechaFirma if Consumo Electronico and < 250K
             # ¯\_(ツ)_/¯
-            if has_sign_date:
-                qr_string += (
-                    "FechaFirma=%s&"
-                    % fields.Datetime.context_timestamp(
-                        self.with_context(tz="America/Santo_Domingo"),
-                        invoice.l10n_do_ecf_sign_date,
-                    ).strftime("%d-%m-%Y %H:%M:%S")
-                )
+            has_sign_date = (
+                doc_code_prefix != "E32" or invoice.amount_total_signed >= 250000
+            )
 
-            qr_string += "CodigoSeguridad=%s" % invoice.l10n_do_ecf_security_code or ""
+            invoice.l10n_do_electronic_stamp = get_l10n_do_electronic_stamp(
+                ecf_service_env,
+                invoice.company_id.vat,
+                invoice.commercial_partner_id.vat or ""
+                if doc_code_prefix[1:] != "43"
+                else None,
+                invoice.ref,
+                invoice.invoice_date or today,
+                amount_total,
+                invoice.l10n_do_ecf_security_code,
+                invoice.l10n_do_ecf_sign_date if has_sign_date else False,
+            )
 
-            invoice.l10n_do_electronic_stamp = urls.url_quote_plus(qr_string)
+    @api.depends("l10n_do_electronic_stamp")
+    def _compute_l10n_do_electronic_stamp_qr(self):
+        # Rendered once per stamp and kept as attachment, so reports don't
+        # generate the QR code image every time they are printed
+        report = self.env["ir.actions.report"]
+        for invoice in self:
+            stamp = invoice.l10n_do_electronic_stamp
+            invoice.l10n_do_electronic_stamp_qr = (
+                base64.b64encode(
+                    report.barcode(
+                        "QR", urls.url_unquote_plus(stamp), width=100, height=100
+                    )
+                )
+                if stamp
+                else False
+            )
 
     def button_cancel(self):
 
         fiscal_invoice = self.filtered(
             lambda inv: inv.l10n_latam_country_code == "DO"
-            and self.type[-6:] in ("nvoice", "refund")
+            and inv.type[-6:] in ("nvoice", "refund")
             and inv.l10n_latam_use_documents
         )
 
-        if len(fiscal_invoice) > 1:
-            raise ValidationError(
-                _("You cannot cancel multiple fiscal invoices at a time.")
-            )
-
         if fiscal_invoice and not self.env.user.has_group(
             "l10n_do_accounting.group_l10n_do_fiscal_invoice_cancel"
         ):
@@ -214,24 +323,100 @@ class AccountMove(models.Model):
             action = self.env.ref(
                 "l10n_do_accounting.action_account_move_cancel"
             ).read()[0]
-            action["context"] = {"default_move_id": fiscal_invoice.id}
+            action["context"] = {
+                "default_move_id": fiscal_invoice[:1].id,
+                "active_model": self._name,
+                "active_ids": fiscal_invoice.ids,
+            }
             return action
 
         return super(AccountMove, self).button_cancel()
 
+    def _l10n_do_cancel_invoices(self, cancellation_type):
+        """
+        Cancel many fiscal invoices at once (i.e. documents to be voided after
+        a failed POS sync). Their states and payment states are checked with a
+        single query and they are cancelled in chunks.
+
+        :param cancellation_type: see _get_l10n_do_cancellation_type()
+        :return: dict with the number of cancelled invoices, in total and by
+        document type
+        """
+        if not self:
+            return {"count": 0, "document_types": {}}
+
+        if any(inv.l10n_latam_use_documents for inv in self) and not (
+            self.env.user.has_group(
+                "l10n_do_accounting.group_l10n_do_fiscal_invoice_cancel"
+            )
+        ):
+            raise AccessError(_("You are not allowed to cancel Fiscal Invoices"))
+
+        self.flush(["state", "invoice_payment_state"])
+        self.env.cr.execute(
+            """
+            SELECT id, state = 'cancel'
+            FROM account_move
+            WHERE id IN %s
+            AND (state = 'cancel'
+                 OR COALESCE(invoice_payment_state, 'not_paid') != 'not_paid');
+            """,
+            (tuple(self.ids),),
+        )
+        rows = self.env.cr.fetchall()
+        cancelled_ids = [move_id for move_id, cancelled in rows if cancelled]
+        paid_ids = [move_id for move_id, cancelled in rows if not cancelled]
+        for invalid_ids, message in (
+            (
+                cancelled_ids,
+                _(
+                    "Selected invoice(s) cannot be cancelled as they are "
+                    "already in 'Cancelled' state."
+                ),
+            ),
+            (
+                paid_ids,
+                _(
+                    "Selected invoice(s) cannot be cancelled as they are "
+                    "already in 'Paid' state."
+                ),
+            ),
+        ):
+            if invalid_ids:
+                if len(self) > 1:
+                    message += "\n%s" % ", ".join(
+                        self.browse(invalid_ids).mapped("display_name")
+                    )
+                raise UserError(message)
+
+        document_types = defaultdict(int)
+        for invoice in self:
+            document_types[invoice.l10n_latam_document_type_id.display_name] += 1
+
+        for chunk_ids in split_every(L10N_DO_BATCH_CHUNK_SIZE, self.ids):
+            chunk = self.browse(chunk_ids)
+            with chunk._l10n_do_update_fiscal_summary():
+                chunk.write(
+                    {"state": "cancel", "l10n_do_cancellation_type": cancellation_type}
+                )
+
+        return {"count": len(self), "document_types": dict(document_types)}
+
     def action_reverse(self):
 
+        self._l10n_do_check_credit_note_access()
+        return super(AccountMove, self).action_reverse()
+
+    def _l10n_do_check_credit_note_access(self):
         fiscal_invoice = self.filtered(
             lambda inv: inv.l10n_latam_country_code == "DO"
-            and self.type[-6:] in ("nvoice", "refund")
+            and inv.type[-6:] in ("nvoice", "refund")
         )
         if fiscal_invoice and not self.env.user.has_group(
             "l10n_do_accounting.group_l10n_do_fiscal_credit_note"
         ):
             raise AccessError(_("You are not allowed to issue Fiscal Credit Notes"))
 
-        return super(AccountMove, self).action_reverse()
-
     @api.depends("ref")
     def _compute_l10n_latam_document_number(self):
         l10n_do_recs = self.filtered(lambda x: x.l10n_latam_country_code == "DO")
@@ -242,6 +427,14 @@ class AccountMove(models.Model):
         super(AccountMove, remaining)._compute_l10n_latam_document_number()
 
     @api.onchange("l10n_latam_document_type_id", "l10n_latam_document_number")
+    def _onchange_l10n_latam_document_number(self):
+        """Normalize the document number as it is typed. An invalid NCF shows a
+        warning instead of blocking the form, it is raised when saving."""
+        try:
+            self._inverse_l10n_latam_document_number()
+        except UserError as e:
+            return {"warning": {"title": _("Invalid NCF"), "message": e.name}}
+
     def _inverse_l10n_latam_document_number(self):
         for rec in self.filtered("l10n_latam_document_type_id"):
             if not rec.l10n_latam_document_number:
@@ -289,28 +482,42 @@ class AccountMove(models.Model):
             self.journal_id.l10n_latam_use_documents
             and self.l10n_latam_country_code == "DO"
         ):
-            res = self.journal_id.l10n_do_sequence_ids.filtered(
-                lambda x: x.l10n_latam_document_type_id
-                == self.l10n_latam_document_type_id
+            sequence_map = self.journal_id._get_l10n_do_sequence_map()
+            return self.env["ir.sequence"].browse(
+                sequence_map.get(self.l10n_latam_document_type_id.id, ())
             )
-            return res
         return super()._get_document_type_sequence()
 
-    @api.constrains("type", "l10n_latam_document_type_id")
-    def _check_invoice_type_document_type(self):
+    def _l10n_do_get_document_type_errors(self):
+        """
+        Check the document type requirements of the whole recordset at once
+
+        :return: list of (invoice, reason, message) of every invoice that
+        doesn't meet them, reason being vat_required or amount_requires_vat
+        """
         l10n_do_invoices = self.filtered(
             lambda inv: inv.l10n_latam_country_code == "DO"
             and inv.l10n_latam_use_documents
             and inv.l10n_latam_document_type_id
         )
+        # Load the columns of every invoice, partner and document type at once
+        l10n_do_invoices.mapped("partner_id.vat")
+        l10n_do_invoices.mapped("l10n_latam_document_type_id.l10n_do_ncf_type")
+        l10n_do_invoices.mapped("amount_untaxed_signed")
+
+        errors = []
         for rec in l10n_do_invoices:
             partner_vat = rec.partner_id.vat
             l10n_latam_document_type = rec.l10n_latam_document_type_id
             if not partner_vat and l10n_latam_document_type.is_vat_required:
-                raise ValidationError(
-                    _(
-                        "A VAT is mandatory for this type of NCF. "
-                        "Please set the current VAT of this client"
+                errors.append(
+                    (
+                        rec,
+                        "vat_required",
+                        _(
+                            "A VAT is mandatory for this type of NCF. "
+                            "Please set the current VAT of this client"
+                        ),
                     )
                 )
 
@@ -318,14 +525,41 @@ class AccountMove(models.Model):
                 if (
                     rec.amount_untaxed_signed >= 250000
                     and l10n_latam_document_type.l10n_do_ncf_type[-7:] != "special"
-                    and not rec.partner_id.vat
+                    and not partner_vat
                 ):
-                    raise UserError(
-                        _(
-                            "If the invoice amount is greater than RD$250,000.00 "
-                            "the customer should have a VAT to validate the invoice"
+                    errors.append(
+                        (
+                            rec,
+                            "amount_requires_vat",
+                            _(
+                                "If the invoice amount is greater than "
+                                "RD$250,000.00 the customer should have a VAT "
+                                "to validate the invoice"
+                            ),
                         )
                     )
+        return errors
+
+    @api.constrains("type", "l10n_latam_document_type_id")
+    def _check_invoice_type_document_type(self):
+        l10n_do_invoices = self.filtered(
+            lambda inv: inv.l10n_latam_country_code == "DO"
+            and inv.l10n_latam_use_documents
+            and inv.l10n_latam_document_type_id
+        )
+        errors = l10n_do_invoices._l10n_do_get_document_type_errors()
+        if len(errors) == 1:
+            invoice, reason, message = errors[0]
+            if reason == "amount_requires_vat":
+                raise UserError(message)
+            raise ValidationError(message)
+        elif errors:
+            raise ValidationError(
+                "\n".join(
+                    "%s: %s" % (invoice.display_name, message)
+                    for invoice, reason, message in errors
+                )
+            )
 
         super(AccountMove, self - l10n_do_invoices)._check_invoice_type_document_type()
 
@@ -348,19 +582,32 @@ class AccountMove(models.Model):
     def _reverse_move_vals(self, default_values, cancel=True):
 
         ctx = self.env.context
-        amount = ctx.get("amount")
-        percentage = ctx.get("percentage")
-        refund_type = ctx.get("refund_type")
-        reason = ctx.get("reason")
-        l10n_do_ecf_modification_code = ctx.get("l10n_do_ecf_modification_code")
-
         res = super(AccountMove, self)._reverse_move_vals(
             default_values=default_values, cancel=cancel
         )
+        return self._l10n_do_update_reverse_move_vals(
+            res,
+            refund_type=ctx.get("refund_type"),
+            percentage=ctx.get("percentage"),
+            amount=ctx.get("amount"),
+            reason=ctx.get("reason"),
+            l10n_do_ecf_modification_code=ctx.get("l10n_do_ecf_modification_code"),
+        )
 
+    def _l10n_do_update_reverse_move_vals(
+        self,
+        vals,
+        refund_type=None,
+        percentage=None,
+        amount=None,
+        reason=None,
+        l10n_do_ecf_modification_code=None,
+    ):
+        """Add the origin NCF, e-CF modification code and, on partial refunds,
+        the percentage or fixed amount line to the values of a reversal"""
         if self.l10n_latam_country_code == "DO":
-            res["l10n_do_origin_ncf"] = self.l10n_latam_document_number
-            res["l10n_do_ecf_modification_code"] = l10n_do_ecf_modification_code
+            vals["l10n_do_origin_ncf"] = self.l10n_latam_document_number
+            vals["l10n_do_ecf_modification_code"] = l10n_do_ecf_modification_code
 
         if refund_type in ("percentage", "fixed_amount"):
             price_unit = (
@@ -368,11 +615,67 @@ class AccountMove(models.Model):
                 if refund_type == "fixed_amount"
                 else self.amount_untaxed * (percentage / 100)
             )
-            res["line_ids"] = False
-            res["invoice_line_ids"] = [
+            vals["line_ids"] = False
+            vals["invoice_line_ids"] = [
                 (0, 0, {"name": reason or _("Refund"), "price_unit": price_unit})
             ]
-        return res
+        return vals
+
+    def l10n_do_batch_reverse(
+        self,
+        refund_type="full_refund",
+        percentage=0.0,
+        amount=0.0,
+        reason=False,
+        l10n_do_ecf_modification_code=False,
+        date=None,
+        journal=None,
+        cancel=False,
+        chunk_size=None,
+    ):
+        """
+        Issue the credit notes of many invoices at once (i.e. a rebate to every
+        customer). The reversals of every chunk are created by _reverse_moves()
+        as the reversal wizard does, posting them with l10n_do_batch_post() so
+        they get their NCFs in a single pass.
+
+        :param refund_type: full_refund, percentage or fixed_amount
+        :param cancel: post the credit notes and reconcile them with their
+        invoice, otherwise they are left in draft. Credit notes dated in the
+        future are posted automatically on their date instead.
+        :return: the credit notes
+        """
+        self._l10n_do_check_credit_note_access()
+        chunk_size = chunk_size or L10N_DO_BATCH_CHUNK_SIZE
+        auto_post = bool(date and date > fields.Date.context_today(self))
+
+        reverse_moves = self.env["account.move"]
+        for chunk_ids in split_every(chunk_size, self.ids):
+            chunk = self.browse(chunk_ids)
+            default_values_list = [
+                {
+                    "ref": _("Reversal of: %s, %s") % (move.name, reason)
+                    if reason
+                    else _("Reversal of: %s") % move.name,
+                    "date": date or move.date,
+                    "invoice_date": move.is_invoice(include_receipts=True)
+                    and (date or move.date)
+                    or False,
+                    "journal_id": journal.id if journal else move.journal_id.id,
+                    "invoice_payment_term_id": None,
+                    "auto_post": auto_post,
+                }
+                for move in chunk
+            ]
+            reverse_moves |= chunk.with_context(
+                refund_type=refund_type,
+                percentage=percentage,
+                amount=amount,
+                reason=reason,
+                l10n_do_ecf_modification_code=l10n_do_ecf_modification_code,
+                l10n_do_batch_post=True,
+            )._reverse_moves(default_values_list, cancel=cancel and not auto_post)
+        return reverse_moves
 
     @api.constrains("name", "partner_id", "company_id")
     def _check_unique_vendor_number(self):
@@ -384,26 +687,78 @@ class AccountMove(models.Model):
             and inv.l10n_latam_document_number
         )
 
-        for rec in l10n_do_invoice:
-            domain = [
-                ("type", "=", rec.type),
-                ("ref", "=", rec.ref),
-                ("company_id", "=", rec.company_id.id),
-                ("id", "!=", rec.id),
-                ("commercial_partner_id", "=", rec.commercial_partner_id.id),
-            ]
-            if rec.search(domain):
+        if l10n_do_invoice:
+            # Duplicates inside the batch, then against the rest of the database
+            # with one query backed by account_move_l10n_do_vendor_ncf_index
+            vendor_numbers = set()
+            for rec in l10n_do_invoice:
+                key = (
+                    rec.type,
+                    rec.ref,
+                    rec.company_id.id,
+                    rec.commercial_partner_id.id,
+                )
+                if key in vendor_numbers:
+                    raise ValidationError(
+                        _("Vendor bill NCF must be unique per vendor and company.")
+                    )
+                vendor_numbers.add(key)
+
+            # Bills without vendor match the ones without vendor, tuple IN
+            # doesn't match NULL
+            with_partner = tuple(key for key in vendor_numbers if key[3])
+            without_partner = tuple(key[:3] for key in vendor_numbers if not key[3])
+            conditions, params = [], []
+            if with_partner:
+                conditions.append(
+                    "(type, ref, company_id, commercial_partner_id) IN %s"
+                )
+                params.append(with_partner)
+            if without_partner:
+                conditions.append(
+                    "(commercial_partner_id IS NULL "
+                    "AND (type, ref, company_id) IN %s)"
+                )
+                params.append(without_partner)
+
+            l10n_do_invoice.flush(
+                ["type", "ref", "company_id", "commercial_partner_id"]
+            )
+            self.env.cr.execute(
+                """
+                SELECT id
+                FROM account_move
+                WHERE type IN ('in_invoice', 'in_refund')
+                AND ref IS NOT NULL
+                AND (%s)
+                AND id NOT IN %%s
+                LIMIT 1;
+                """
+                % " OR ".join(conditions),
+                params + [tuple(l10n_do_invoice.ids)],
+            )
+            if self.env.cr.fetchone():
                 raise ValidationError(
                     _("Vendor bill NCF must be unique per vendor and company.")
                 )
         return super(AccountMove, self - l10n_do_invoice)._check_unique_vendor_number()
 
     def post(self):
+        if self.env.context.get("l10n_do_batch_post") and self.env.context.get(
+            "move_reverse_cancel"
+        ):
+            # Only the reversals posted by _reverse_moves(), not the moves it
+            # posts while reconciling them. See l10n_do_batch_reverse()
+            return self.with_context(l10n_do_batch_post=False).l10n_do_batch_post()
 
-        res = super(AccountMove, self).post()
+        with self._l10n_do_update_fiscal_summary():
+            res = super(
+                AccountMove, self.with_context(l10n_do_skip_fiscal_summary=True)
+            ).post()
 
+        country_do = self.env.ref("base.do")
         non_payer_type_invoices = self.filtered(
-            lambda inv: inv.company_id.country_id == self.env.ref("base.do")
+            lambda inv: inv.company_id.country_id == country_do
             and inv.l10n_latam_use_documents
             and not inv.partner_id.l10n_do_dgii_tax_payer_type
         )
@@ -412,14 +767,197 @@ class AccountMove(models.Model):
 
         return res
 
-    def init(self):  # DO NOT FORWARD PORT
-        cancelled_invoices = self.search(
-            [
-                ("state", "=", "cancel"),
-                ("l10n_latam_use_documents", "=", True),
-                ("cancellation_type", "!=", False),
-                ("l10n_do_cancellation_type", "=", False),
-            ]
+    def _l10n_do_check_batch_post(self):
+        """Check the fiscal requirements of many invoices at once, reporting
+        every invoice that fails instead of the first one. See
+        _l10n_do_get_document_type_errors()"""
+        country_do = self.env.ref("base.do")
+        fiscal_invoices = self.filtered(
+            lambda inv: inv.company_id.country_id == country_do
+            and inv.l10n_latam_use_documents
+        )
+        errors = []
+        non_payer_type_invoices = fiscal_invoices.filtered(
+            lambda inv: not inv.partner_id.l10n_do_dgii_tax_payer_type
+        )
+        if non_payer_type_invoices:
+            errors.append(
+                _("Fiscal invoices require partner fiscal type: %s")
+                % ", ".join(non_payer_type_invoices.mapped("display_name"))
+            )
+        errors.extend(
+            "%s: %s" % (invoice.display_name, message)
+            for invoice, reason, message in (
+                fiscal_invoices._l10n_do_get_document_type_errors()
+            )
         )
-        for invoice in cancelled_invoices:
-            invoice.l10n_do_cancellation_type = invoice.cancellation_type
+        if errors:
+            raise ValidationError("\n".join(errors))
+
+    def l10n_do_batch_post(self, chunk_size=None):
+        """
+        Post many invoices (i.e. month-end consumer invoices). Fiscal
+        requirements are checked for all of them before posting anything, then
+        invoices are posted in chunks sharing company, journal and document
+        type, whose NCFs are taken from their sequence with a single statement
+        per chunk. Changes are flushed once per chunk.
+
+        :param chunk_size: invoices posted per chunk
+        :return: list of dicts with the throughput of every chunk
+        """
+        chunk_size = chunk_size or L10N_DO_BATCH_CHUNK_SIZE
+        self._l10n_do_check_batch_post()
+
+        groups = defaultdict(list)
+        for invoice in self:
+            key = (
+                invoice.company_id.id,
+                invoice.journal_id.id,
+                invoice.l10n_latam_document_type_id.id,
+            )
+            groups[key].append(invoice.id)
+
+        stats = []
+        for (company_id, journal_id, document_type_id), invoice_ids in groups.items():
+            for chunk_ids in split_every(chunk_size, invoice_ids):
+                chunk = self.browse(chunk_ids)
+                start = time.time()
+                chunk._l10n_do_post_chunk()
+                duration = time.time() - start
+                stats.append(
+                    {
+                        "company_id": company_id,
+                        "journal_id": journal_id,
+                        "document_type_id": document_type_id,
+                        "count": len(chunk),
+                        "duration": duration,
+                    }
+                )
+                _logger.info(
+                    "Posted %s invoices of journal %s, document type %s in "
+                    "%.2fs (%.0f invoices/s)"
+                    % (
+                        len(chunk),
+                        journal_id,
+                        document_type_id,
+                        duration,
+                        len(chunk) / duration if duration else 0,
+                    )
+                )
+        return stats
+
+    def _l10n_do_post_chunk(self):
+        """Post invoices sharing journal and document type. Their NCFs are
+        reserved at once in the current transaction and the ones not used are
+        given back to the sequence, so it stays gap-free."""
+        sequence = self[:1].l10n_latam_sequence_id
+        if (
+            self[:1].l10n_latam_country_code != "DO"
+            or len(sequence) != 1
+            or sequence.implementation != "no_gap"
+            or sequence.use_date_range
+        ):
+            self.post()
+            self.flush()
+            return
+
+        numbers = sequence._l10n_do_reserve_numbers(len(self))
+        try:
+            self.with_context(
+                l10n_do_reserved_numbers={sequence.id: numbers}
+            ).post()
+            self.flush()
+        except psycopg2.Error:
+            # The transaction is aborted, rolling it back undoes the reservation
+            raise
+        except Exception:
+            sequence._l10n_do_release_numbers(numbers)
+            raise
+        sequence._l10n_do_release_numbers(numbers)
+
+    def button_draft(self):
+        with self._l10n_do_update_fiscal_summary():
+            return super(
+                AccountMove, self.with_context(l10n_do_skip_fiscal_summary=True)
+            ).button_draft()
+
+    def write(self, vals):
+        if (
+            "state" in vals
+            or self.env.context.get("l10n_do_skip_fiscal_summary")
+            or not L10N_DO_SUMMARY_FIELDS.intersection(vals)
+        ):
+            return super(AccountMove, self).write(vals)
+
+        # i.e. the income type of a posted invoice is changed
+        with self._l10n_do_update_fiscal_summary():
+            return super(AccountMove, self).write(vals)
+
+    def _l10n_do_get_summary_moves(self):
+        """Return the moves counted by l10n_do.fiscal.summary"""
+        country_do = self.env.ref("base.do")
+        return self.filtered(
+            lambda inv: inv.state in ("posted", "cancel")
+            and inv.type != "entry"
+            and inv.invoice_date
+            and inv.journal_id.l10n_latam_use_documents
+            and inv.l10n_latam_document_type_id.country_id == country_do
+        )
+
+    @contextmanager
+    def _l10n_do_update_fiscal_summary(self):
+        """Replace the contribution of the fiscal invoices to
+        l10n_do.fiscal.summary by the one they have after the wrapped changes.
+        Changes made inside must not update the summary again, see
+        l10n_do_skip_fiscal_summary."""
+        summary = self.env["l10n_do.fiscal.summary"].sudo()
+        summary._add_moves(self._l10n_do_get_summary_moves(), -1)
+        try:
+            yield
+        except psycopg2.Error:
+            # The transaction is aborted, rolling it back undoes the summary
+            raise
+        except Exception:
+            summary._add_moves(self._l10n_do_get_summary_moves(), 1)
+            raise
+        summary._add_moves(self._l10n_do_get_summary_moves(), 1)
+
+    def init(self):
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS account_move_l10n_do_vendor_ncf_index
+            ON account_move (company_id, commercial_partner_id, ref, type)
+            WHERE type IN ('in_invoice', 'in_refund') AND ref IS NOT NULL;
+            """
+        )
+
+        # DO NOT FORWARD PORT
+        # Backfill the new cancellation type field in SQL, after the first run
+        # the EXISTS check is the only cost of a module update
+        backfill_where = """
+            am.state = 'cancel'
+            AND am.cancellation_type IS NOT NULL
+            AND am.l10n_do_cancellation_type IS NULL
+            AND aj.id = am.journal_id
+            AND aj.l10n_latam_use_documents
+        """
+        self.env.cr.execute(
+            """
+            SELECT EXISTS(
+                SELECT 1
+                FROM account_move AS am, account_journal AS aj
+                WHERE %s
+            );
+            """
+            % backfill_where
+        )
+        if self.env.cr.fetchone()[0]:
+            self.env.cr.execute(
+                """
+                UPDATE account_move AS am
+                SET l10n_do_cancellation_type = am.cancellation_type
+                FROM account_journal AS aj
+                WHERE %s;
+                """
+                % backfill_where
+            )
@@ -1,4 +1,25 @@
-from odoo import models, fields
+from collections import defaultdict
+
+from odoo import models, fields, api
+
+# ITBIS of a move (aliased am) for SQL reports: e-CF invoices keep it on their
+# lines, the rest is the balance of their ITBIS tax lines
+L10N_DO_ITBIS_AMOUNT_SQL = """
+    COALESCE(
+        NULLIF(
+            (SELECT SUM(aml.l10n_do_itbis_amount)
+             FROM account_move_line aml
+             WHERE aml.move_id = am.id),
+            0
+        ),
+        (SELECT SUM(ABS(aml.balance))
+         FROM account_move_line aml
+         JOIN account_tax tax ON tax.id = aml.tax_line_id
+         WHERE aml.move_id = am.id
+         AND tax.tax_group_id = %(itbis_group_id)s),
+        0
+    )
+"""
 
 
 class AccountMoveLine(models.Model):
@@ -6,44 +27,36 @@ class AccountMoveLine(models.Model):
 
     l10n_do_itbis_amount = fields.Monetary(
         string="ITBIS Amount",
+        compute="_compute_l10n_do_itbis_amount",
         store=True,
         readonly=True,
         currency_field="always_set_currency_id",
     )
 
-    def _get_price_total_and_subtotal(
-        self,
-        price_unit=None,
-        quantity=None,
-        discount=None,
-        currency=None,
-        product=None,
-        partner=None,
-        taxes=None,
-        move_type=None,
-    ):
-        self.ensure_one()
-        res = super(AccountMoveLine, self)._get_price_total_and_subtotal(
-            price_unit=price_unit,
-            quantity=quantity,
-            discount=discount,
-            currency=currency,
-            product=product,
-            partner=partner,
-            taxes=taxes,
-            move_type=move_type,
-        )
-
-        if self.move_id.is_ecf_invoice:
+    @api.depends("price_unit", "quantity", "tax_ids", "move_id.is_ecf_invoice")
+    def _compute_l10n_do_itbis_amount(self):
+        """Compute the ITBIS of e-CF invoice lines in one pass: lines are
+        grouped by tax set, whose ITBIS taxes are resolved once, and lines with
+        the same price and quantity share the result"""
+        itbis_group = self.env.ref("l10n_do.group_itbis")
+        lines_by_taxes = defaultdict(list)
+        for line in self:
+            if line.move_id.is_ecf_invoice:
+                lines_by_taxes[line.tax_ids].append(line)
+            else:
+                line.l10n_do_itbis_amount = 0.0
 
-            line_itbis_taxes = self.tax_ids.filtered(
-                lambda t: t.tax_group_id == self.env.ref("l10n_do.group_itbis")
-            )
-            itbis_taxes_data = line_itbis_taxes.compute_all(
-                price_unit=self.price_unit,
-                quantity=self.quantity,
-            )
-            res["l10n_do_itbis_amount"] = sum(
-                [t["amount"] for t in itbis_taxes_data["taxes"]]
-            )
-        return res
+        for taxes, lines in lines_by_taxes.items():
+            line_itbis_taxes = taxes.filtered(lambda t: t.tax_group_id == itbis_group)
+            amounts = {}
+            for line in lines:
+                key = (line.price_unit, line.quantity)
+                if key not in amounts:
+                    itbis_taxes_data = line_itbis_taxes.compute_all(
+                        price_unit=line.price_unit,
+                        quantity=line.quantity,
+                    )
+                    amounts[key] = sum(
+                        [t["amount"] for t in itbis_taxes_data["taxes"]]
+                    )
+                line.l10n_do_itbis_amount = amounts[key]
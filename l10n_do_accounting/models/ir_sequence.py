@@ -0,0 +1,163 @@
+import collections
+
+from odoo import api, fields, models
+
+from .l10n_do_ncf_block import (
+    add_pending_ncf_number,
+    get_ncf_block_lock,
+    is_ncf_sequence_locked,
+    mark_ncf_sequence_locked,
+    release_ncf_block,
+    reserve_ncf_block,
+    reserved_ncf_blocks,
+)
+
+
+class IrSequence(models.Model):
+    _inherit = "ir.sequence"
+
+    l10n_do_ncf_released_blocks = fields.Boolean(
+        "Released NCF blocks",
+        readonly=True,
+        copy=False,
+        help="Set when unused NCF of this sequence are recorded as released "
+        "blocks, which are handed out before new numbers.",
+    )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        if any(vals.get("l10n_latam_journal_id") for vals in vals_list):
+            # See account.journal._get_l10n_do_sequence_map()
+            self.clear_caches()
+        return res
+
+    def write(self, values):
+        to_check = {"l10n_latam_journal_id", "l10n_latam_document_type_id", "active"}
+        res = super().write(values)
+        if to_check.intersection(values.keys()):
+            self.clear_caches()
+        return res
+
+    def unlink(self):
+        clear = any(self.mapped("l10n_latam_journal_id"))
+        res = super().unlink()
+        if clear:
+            self.clear_caches()
+        return res
+
+    def _next_do(self):
+        reserved_numbers = self.env.context.get("l10n_do_reserved_numbers", {})
+        if reserved_numbers.get(self.id):
+            return self.get_next_char(reserved_numbers[self.id].popleft())
+
+        if (
+            self.implementation == "no_gap"
+            and self.l10n_latam_document_type_id
+            and self.company_id.country_id == self.env.ref("base.do")
+        ):
+            key = (self.env.cr.dbname, self.id)
+            if not is_ncf_sequence_locked(self.env.cr, key):
+                # Released blocks are handed out whatever the block size is,
+                # so no NCF is left unused when blocks are disabled
+                block_size = max(self.company_id.l10n_do_ncf_block_size, 0)
+                number = self._l10n_do_next_reserved_number(block_size)
+                if number is not None:
+                    return self.get_next_char(number)
+                # The row is locked by this transaction from now on
+                mark_ncf_sequence_locked(self.env.cr, key)
+        return super()._next_do()
+
+    def _l10n_do_next_reserved_number(self, block_size):
+        """
+        NCF block reservation: instead of locking the sequence row until the
+        posting transaction ends, this process reserves block_size numbers in a
+        short transaction and hands them out locally. A number whose transaction
+        is rolled back, or that no move uses once it is committed, goes back to
+        the block, and unused numbers are given back to the sequence or recorded
+        as released blocks (see l10n_do.ncf.block), so the NCF sequence stays
+        gap-free. Blocks reserved with another block size, i.e. changed by
+        another worker, are released.
+
+        :param block_size: company block size, with 0 only released blocks are
+        handed out, if the sequence has any (l10n_do_ncf_released_blocks)
+        :return: the next number, None if no block could be reserved
+        """
+        self.ensure_one()
+        key = (self.env.cr.dbname, self.id)
+        with get_ncf_block_lock(key):
+            block = reserved_ncf_blocks.get(key)
+            if block and (
+                not block.numbers
+                or block.is_expired()
+                or block.block_size != block_size
+            ):
+                del reserved_ncf_blocks[key]
+                release_ncf_block(block)
+                block = None
+            if not block:
+                if not block_size and not self.l10n_do_ncf_released_blocks:
+                    return None
+                block = reserve_ncf_block(self.pool, self.id, block_size)
+                self.invalidate_cache(
+                    [
+                        "number_next",
+                        "number_next_actual",
+                        "l10n_do_ncf_released_blocks",
+                    ],
+                    self.ids,
+                )
+                if not block:
+                    return None
+                reserved_ncf_blocks[key] = block
+            number = block.numbers.popleft()
+
+        add_pending_ncf_number(
+            self.env.cr,
+            key,
+            block,
+            number,
+            self.l10n_latam_journal_id.id,
+            self.get_next_char(number),
+        )
+        return number
+
+    def _l10n_do_reserve_numbers(self, count):
+        """Take count numbers of a no_gap sequence with a single statement. The
+        sequence row stays locked until the current transaction ends, see
+        _l10n_do_release_numbers() for the numbers that aren't used."""
+        self.ensure_one()
+        self.flush(["number_next"])
+        self.env.cr.execute(
+            """
+            UPDATE ir_sequence
+            SET number_next = number_next + number_increment * %s
+            WHERE id = %s
+            RETURNING number_next - number_increment * %s, number_increment;
+            """,
+            (count, self.id, count),
+        )
+        number_from, increment = self.env.cr.fetchone()
+        mark_ncf_sequence_locked(self.env.cr, (self.env.cr.dbname, self.id))
+        self.invalidate_cache(["number_next", "number_next_actual"], self.ids)
+        return collections.deque(
+            range(number_from, number_from + increment * count, increment)
+        )
+
+    def _l10n_do_release_numbers(self, numbers):
+        """Give back the numbers reserved by _l10n_do_reserve_numbers() that
+        weren't used, they are always the last ones taken from the sequence"""
+        self.ensure_one()
+        if not numbers:
+            return
+        self.env.cr.execute(
+            """
+            UPDATE ir_sequence
+            SET number_next = %s
+            WHERE id = %s
+            AND number_next = %s;
+            """,
+            (numbers[0], self.id, numbers[-1] + self.number_increment),
+        )
+        numbers.clear()
+        self.invalidate_cache(["number_next", "number_next_actual"], self.ids)
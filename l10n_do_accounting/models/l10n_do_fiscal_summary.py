@@ -0,0 +1,256 @@
+import logging
+
+from odoo import api, fields, models, tools
+
+from .account_move_line import L10N_DO_ITBIS_AMOUNT_SQL
+
+_logger = logging.getLogger(__name__)
+
+SUMMARY_KEY = (
+    "company_id",
+    "date",
+    "l10n_latam_document_type_id",
+    "l10n_do_income_type",
+    "l10n_do_expense_type",
+)
+SUMMARY_MEASURES = ("move_count", "cancelled_count", "amount_untaxed", "itbis_amount")
+
+# Fields read by SUMMARY_SELECT, flushed before adding moves
+SUMMARY_MOVE_FIELDS = [
+    "company_id",
+    "journal_id",
+    "type",
+    "state",
+    "invoice_date",
+    "l10n_latam_document_type_id",
+    "l10n_do_income_type",
+    "l10n_do_expense_type",
+    "amount_untaxed_signed",
+]
+SUMMARY_LINE_FIELDS = ["move_id", "balance", "tax_line_id", "l10n_do_itbis_amount"]
+
+# Contribution of DO fiscal invoices (aliased am) to the summary, multiplied by
+# %(sign)s: posted ones count with their amounts, cancelled ones are only
+# counted. Amounts are in company currency, negative on refunds.
+SUMMARY_SELECT = """
+    SELECT am.company_id,
+           date_trunc('month', am.invoice_date)::date,
+           am.l10n_latam_document_type_id,
+           am.l10n_do_income_type,
+           am.l10n_do_expense_type,
+           %%(sign)s * COUNT(*) FILTER (WHERE am.state = 'posted'),
+           %%(sign)s * COUNT(*) FILTER (WHERE am.state = 'cancel'),
+           %%(sign)s * COALESCE(
+               SUM(%(refund_sign)s * ABS(am.amount_untaxed_signed))
+               FILTER (WHERE am.state = 'posted'),
+               0
+           ),
+           %%(sign)s * COALESCE(
+               SUM(%(refund_sign)s * %(itbis_amount)s)
+               FILTER (WHERE am.state = 'posted'),
+               0
+           )
+    FROM account_move am
+    JOIN account_journal aj ON aj.id = am.journal_id
+    JOIN l10n_latam_document_type dt ON dt.id = am.l10n_latam_document_type_id
+    WHERE aj.l10n_latam_use_documents
+    AND dt.country_id = %%(country_id)s
+    AND am.type != 'entry'
+    AND am.invoice_date IS NOT NULL
+    AND am.state IN ('posted', 'cancel')
+    AND {where}
+    GROUP BY 1, 2, 3, 4, 5
+""" % {
+    "refund_sign": "(CASE WHEN am.type LIKE '%%refund' THEN -1 ELSE 1 END)",
+    "itbis_amount": L10N_DO_ITBIS_AMOUNT_SQL,
+}
+
+
+class L10nDoFiscalSummary(models.Model):
+    """
+    Fiscal invoice totals per company, month, document type, income type and
+    expense type. Moves add rows when they are posted, cancelled or set back to
+    draft (see account.move.write()), which only insert so concurrent postings
+    don't wait for each other. _compact() merges them, rebuild() computes the
+    summary again from the invoices. Users read it through
+    l10n_do.fiscal.summary.report, which adds the rows up.
+    """
+
+    _name = "l10n_do.fiscal.summary"
+    _description = "Fiscal Period Summary"
+    _order = "date desc, company_id, l10n_latam_document_type_id"
+
+    company_id = fields.Many2one("res.company", required=True, readonly=True)
+    currency_id = fields.Many2one(related="company_id.currency_id")
+    date = fields.Date(string="Period", required=True, readonly=True, index=True)
+    l10n_latam_document_type_id = fields.Many2one(
+        "l10n_latam.document.type",
+        string="Document Type",
+        readonly=True,
+    )
+    l10n_do_income_type = fields.Selection(
+        selection=lambda self: self.env["account.move"]._get_l10n_do_income_type(),
+        string="Income Type",
+        readonly=True,
+    )
+    l10n_do_expense_type = fields.Selection(
+        selection=lambda self: self.env["res.partner"]._get_l10n_do_expense_type(),
+        string="Cost & Expense Type",
+        readonly=True,
+    )
+    move_count = fields.Integer(string="Invoices", readonly=True)
+    cancelled_count = fields.Integer(string="Cancelled", readonly=True)
+    amount_untaxed = fields.Monetary(readonly=True)
+    itbis_amount = fields.Monetary(string="ITBIS", readonly=True)
+
+    def _insert_summary(self, where, params):
+        params = dict(
+            params,
+            country_id=self.env.ref("base.do").id,
+            itbis_group_id=self.env.ref("l10n_do.group_itbis").id,
+        )
+        self.env.cr.execute(
+            """
+            INSERT INTO l10n_do_fiscal_summary (%s, create_uid, create_date,
+                                                write_uid, write_date)
+            SELECT summary.*, %%(uid)s, now() at time zone 'UTC',
+                   %%(uid)s, now() at time zone 'UTC'
+            FROM (%s) AS summary;
+            """
+            % (
+                ", ".join(SUMMARY_KEY + SUMMARY_MEASURES),
+                SUMMARY_SELECT.format(where=where),
+            ),
+            dict(params, uid=self.env.uid),
+        )
+
+    @api.model
+    def _add_moves(self, moves, sign=1):
+        """Add (sign 1) or remove (sign -1) the current contribution of moves"""
+        if not moves:
+            return
+        self.env["account.move"].flush(SUMMARY_MOVE_FIELDS, moves)
+        self.env["account.move.line"].flush(SUMMARY_LINE_FIELDS, moves.line_ids)
+        self._insert_summary(
+            "am.id IN %(move_ids)s", {"move_ids": tuple(moves.ids), "sign": sign}
+        )
+        self.invalidate_cache()
+
+    @api.model
+    def _compact(self):
+        """Merge the rows added by the moves into a single row per key"""
+        self.flush()
+        self.env.cr.execute("SELECT MAX(id) FROM l10n_do_fiscal_summary")
+        max_id = self.env.cr.fetchone()[0]
+        if not max_id:
+            return
+        key = ", ".join(SUMMARY_KEY)
+        measures = ", ".join("SUM(%s)" % measure for measure in SUMMARY_MEASURES)
+        self.env.cr.execute(
+            """
+            WITH deleted AS (
+                DELETE FROM l10n_do_fiscal_summary
+                WHERE id <= %%(max_id)s
+                RETURNING *
+            )
+            INSERT INTO l10n_do_fiscal_summary (%s, %s, create_uid, create_date,
+                                                write_uid, write_date)
+            SELECT %s, %s, %%(uid)s, now() at time zone 'UTC',
+                   %%(uid)s, now() at time zone 'UTC'
+            FROM deleted
+            GROUP BY %s
+            HAVING %s;
+            """
+            % (
+                key,
+                ", ".join(SUMMARY_MEASURES),
+                key,
+                measures,
+                key,
+                " OR ".join("SUM(%s) != 0" % m for m in SUMMARY_MEASURES),
+            ),
+            {"max_id": max_id, "uid": self.env.uid},
+        )
+        self.invalidate_cache()
+
+    @api.model
+    def rebuild(self, companies=None):
+        """Compute the summary again from the fiscal invoices, i.e. after
+        changing moves with SQL. Can be run from a shell:
+        env["l10n_do.fiscal.summary"].rebuild()"""
+        companies = companies or self.env["res.company"].search([])
+        self.flush()
+        self.env["account.move"].flush()
+        self.env["account.move.line"].flush()
+        self.env.cr.execute(
+            "DELETE FROM l10n_do_fiscal_summary WHERE company_id IN %s",
+            (tuple(companies.ids),),
+        )
+        self._insert_summary(
+            "am.company_id IN %(company_ids)s",
+            {"company_ids": tuple(companies.ids), "sign": 1},
+        )
+        self.invalidate_cache()
+        _logger.info("Rebuilt fiscal summary of companies %s" % companies.ids)
+        return True
+
+    def action_rebuild(self):
+        self.rebuild(self.env.companies)
+        return {"type": "ir.actions.client", "tag": "reload"}
+
+
+class L10nDoFiscalSummaryReport(models.Model):
+    """Rows of l10n_do.fiscal.summary added up by key, so the ones moves add
+    before _compact() runs never show as partial or negative totals"""
+
+    _name = "l10n_do.fiscal.summary.report"
+    _description = "Fiscal Period Summary Report"
+    _auto = False
+    _order = "date desc, company_id, l10n_latam_document_type_id"
+
+    company_id = fields.Many2one("res.company", readonly=True)
+    currency_id = fields.Many2one(related="company_id.currency_id")
+    date = fields.Date(string="Period", readonly=True)
+    l10n_latam_document_type_id = fields.Many2one(
+        "l10n_latam.document.type",
+        string="Document Type",
+        readonly=True,
+    )
+    l10n_do_income_type = fields.Selection(
+        selection=lambda self: self.env["account.move"]._get_l10n_do_income_type(),
+        string="Income Type",
+        readonly=True,
+    )
+    l10n_do_expense_type = fields.Selection(
+        selection=lambda self: self.env["res.partner"]._get_l10n_do_expense_type(),
+        string="Cost & Expense Type",
+        readonly=True,
+    )
+    move_count = fields.Integer(string="Invoices", readonly=True)
+    cancelled_count = fields.Integer(string="Cancelled", readonly=True)
+    amount_untaxed = fields.Monetary(readonly=True)
+    itbis_amount = fields.Monetary(string="ITBIS", readonly=True)
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        key = ", ".join(SUMMARY_KEY)
+        self.env.cr.execute(
+            """
+            CREATE OR REPLACE VIEW %s AS (
+                SELECT MIN(id) AS id, %s, %s
+                FROM l10n_do_fiscal_summary
+                GROUP BY %s
+                HAVING %s
+            );
+            """
+            % (
+                self._table,
+                key,
+                ", ".join("SUM(%s) AS %s" % (m, m) for m in SUMMARY_MEASURES),
+                key,
+                " OR ".join("SUM(%s) != 0" % m for m in SUMMARY_MEASURES),
+            )
+        )
+
+    def action_rebuild(self):
+        return self.env["l10n_do.fiscal.summary"].sudo().action_rebuild()
@@ -0,0 +1,439 @@
+import atexit
+import collections
+import logging
+import os
+import socket
+import threading
+import time
+import weakref
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import partial
+
+from psycopg2 import OperationalError, errorcodes
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Blocks are given back after being held this many seconds, blocks reserved for
+# twice as long are considered abandoned (i.e. their worker crashed)
+NCF_BLOCK_TTL = 3600
+
+# The sequence row may be locked by the transaction asking for a block, which
+# can't commit while it waits for its own reservation
+NCF_BLOCK_LOCK_TIMEOUT = "5s"
+
+# NCF blocks reserved by this process: {(dbname, sequence_id): ReservedNcfBlock}
+reserved_ncf_blocks = {}
+
+# One lock per (dbname, sequence_id), held while the block of the sequence is
+# reserved or released, so workers only wait for the ones using the same sequence
+ncf_block_locks = defaultdict(threading.RLock)
+ncf_block_locks_lock = threading.Lock()
+
+# Numbers handed out to the current transaction of each cursor:
+# {cursor: [(key, block, number, journal_id, ncf)]}
+pending_ncf_numbers = weakref.WeakKeyDictionary()
+
+# Sequences whose row is locked by the current transaction of each cursor, a
+# block reservation would wait for it until the lock timeout: {cursor: {key}}
+locked_ncf_sequences = weakref.WeakKeyDictionary()
+
+
+class ReservedNcfBlock(object):
+    """Numbers of a l10n_do.ncf.block held in memory by this process"""
+
+    def __init__(self, registry, block_id, sequence_id, increment, numbers, block_size):
+        self.registry = registry
+        self.block_id = block_id
+        self.sequence_id = sequence_id
+        self.increment = increment
+        self.numbers = collections.deque(numbers)
+        # Company block size the block was reserved with
+        self.block_size = block_size
+        self.reserved_at = time.time()
+
+    def is_expired(self):
+        return time.time() - self.reserved_at > NCF_BLOCK_TTL
+
+
+def get_ncf_block_owner():
+    return "%s-%s" % (socket.gethostname(), os.getpid())
+
+
+def get_ncf_block_lock(key):
+    with ncf_block_locks_lock:
+        return ncf_block_locks[key]
+
+
+def mark_ncf_sequence_locked(cr, key):
+    """Remember the current transaction of cr locks the row of a sequence, no
+    block of it is reserved until the transaction ends"""
+    locked = locked_ncf_sequences.get(cr)
+    if locked is None:
+        locked = locked_ncf_sequences[cr] = set()
+        cr.after("commit", partial(locked_ncf_sequences.pop, cr, None))
+        cr.after("rollback", partial(locked_ncf_sequences.pop, cr, None))
+    locked.add(key)
+
+
+def is_ncf_sequence_locked(cr, key):
+    return key in locked_ncf_sequences.get(cr, ())
+
+
+@contextmanager
+def ncf_block_cursor(registry):
+    """Short transaction, committed right away, in which blocks are reserved
+    and released. Workers only wait for each other during the reservation."""
+    with registry.cursor() as cr:
+        # Test cursors run inside the transaction of the test
+        if not registry.in_test_mode():
+            cr.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+        cr.execute("SET LOCAL lock_timeout = %s", (NCF_BLOCK_LOCK_TIMEOUT,))
+        yield cr
+
+
+def record_unused_ncf_numbers(cr, sequence_id, increment, numbers):
+    """Give unused numbers back to their sequence when they are the last ones
+    it handed out, otherwise record them as released blocks, which are reserved
+    before new numbers are taken from the sequence. Either way no NCF is lost."""
+    runs = []
+    for number in sorted(numbers):
+        if runs and number == runs[-1][1] + increment:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    if not runs:
+        return
+
+    number_from, number_to = runs[-1]
+    cr.execute(
+        """
+        UPDATE ir_sequence
+        SET number_next = %s
+        WHERE id = %s
+        AND number_next = %s;
+        """,
+        (number_from, sequence_id, number_to + increment),
+    )
+    if cr.rowcount:
+        runs.pop()
+    if not runs:
+        return
+
+    # See ir.sequence._l10n_do_next_reserved_number()
+    cr.execute(
+        """
+        UPDATE ir_sequence
+        SET l10n_do_ncf_released_blocks = TRUE
+        WHERE id = %s
+        AND l10n_do_ncf_released_blocks IS NOT TRUE;
+        """,
+        (sequence_id,),
+    )
+    for number_from, number_to in runs:
+        cr.execute(
+            """
+            INSERT INTO l10n_do_ncf_block
+            (sequence_id, number_from, number_to, state, create_date, write_date)
+            VALUES (%s, %s, %s, 'released',
+                    now() at time zone 'UTC', now() at time zone 'UTC');
+            """,
+            (sequence_id, number_from, number_to),
+        )
+
+
+def reserve_ncf_block(registry, sequence_id, block_size):
+    """Reserve a block of numbers of a sequence for this process. Released
+    blocks are reserved first, with a block_size of 0 only them are. Return
+    None when the sequence isn't visible outside of the current transaction
+    yet or is locked by it."""
+    try:
+        row = _reserve_ncf_block(registry, sequence_id, block_size)
+    except OperationalError as e:
+        if e.pgcode != errorcodes.LOCK_NOT_AVAILABLE:
+            raise
+        _logger.warning(
+            "Could not reserve a NCF block of sequence %s, it is locked"
+            % sequence_id
+        )
+        return None
+    if not row:
+        return None
+
+    block_id, number_from, number_to, increment = row
+    _logger.info(
+        "Reserved NCF block %s-%s of sequence %s"
+        % (number_from, number_to, sequence_id)
+    )
+    return ReservedNcfBlock(
+        registry,
+        block_id,
+        sequence_id,
+        increment,
+        range(number_from, number_to + 1, increment),
+        block_size,
+    )
+
+
+def _reserve_ncf_block(registry, sequence_id, block_size):
+    owner = get_ncf_block_owner()
+    with ncf_block_cursor(registry) as cr:
+        cr.execute(
+            """
+            UPDATE l10n_do_ncf_block AS block
+            SET state = 'reserved',
+                owner = %s,
+                write_date = (now() at time zone 'UTC')
+            FROM ir_sequence AS seq
+            WHERE block.id = (
+                SELECT id
+                FROM l10n_do_ncf_block
+                WHERE sequence_id = %s
+                AND state = 'released'
+                ORDER BY number_from
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            AND seq.id = block.sequence_id
+            RETURNING block.id, block.number_from, block.number_to,
+            seq.number_increment;
+            """,
+            (owner, sequence_id),
+        )
+        row = cr.fetchone()
+        if not row and not block_size:
+            # Every released block has been reserved. The flag is left as is
+            # when another transaction is locking the sequence, it may be
+            # releasing a block.
+            cr.execute(
+                """
+                UPDATE ir_sequence
+                SET l10n_do_ncf_released_blocks = FALSE
+                WHERE id = (
+                    SELECT id
+                    FROM ir_sequence
+                    WHERE id = %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM l10n_do_ncf_block
+                    WHERE sequence_id = %s
+                    AND state = 'released'
+                );
+                """,
+                (sequence_id, sequence_id),
+            )
+        elif not row:
+            cr.execute(
+                """
+                UPDATE ir_sequence
+                SET number_next = number_next + number_increment * %s
+                WHERE id = %s
+                RETURNING number_next - number_increment * %s,
+                number_next - number_increment, number_increment;
+                """,
+                (block_size, sequence_id, block_size),
+            )
+            reserved = cr.fetchone()
+            if not reserved:
+                return None
+            number_from, number_to, increment = reserved
+            cr.execute(
+                """
+                INSERT INTO l10n_do_ncf_block
+                (sequence_id, number_from, number_to, state, owner,
+                 create_date, write_date)
+                VALUES (%s, %s, %s, 'reserved', %s,
+                        now() at time zone 'UTC', now() at time zone 'UTC')
+                RETURNING id;
+                """,
+                (sequence_id, number_from, number_to, owner),
+            )
+            row = (cr.fetchone()[0], number_from, number_to, increment)
+    return row
+
+
+def release_ncf_block(block):
+    """Close a block of this process and record the numbers it didn't use. If
+    that isn't possible the block is left to _recover_abandoned_blocks()."""
+    try:
+        with ncf_block_cursor(block.registry) as cr:
+            cr.execute(
+                """
+                UPDATE l10n_do_ncf_block
+                SET state = 'done',
+                    write_date = (now() at time zone 'UTC')
+                WHERE id = %s
+                AND state = 'reserved'
+                AND owner = %s;
+                """,
+                (block.block_id, get_ncf_block_owner()),
+            )
+            # Otherwise it has been recovered as abandoned in the meantime
+            if cr.rowcount:
+                record_unused_ncf_numbers(
+                    cr, block.sequence_id, block.increment, block.numbers
+                )
+    except OperationalError as e:
+        if e.pgcode != errorcodes.LOCK_NOT_AVAILABLE:
+            raise
+        _logger.warning(
+            "Could not release NCF block %s, it will be recovered" % block.block_id
+        )
+    block.numbers.clear()
+
+
+def give_back_ncf_number(key, block, number):
+    """Called when the transaction that used a reserved number is rolled back"""
+    with get_ncf_block_lock(key):
+        if reserved_ncf_blocks.get(key) is block:
+            block.numbers.appendleft(number)
+            return
+    with ncf_block_cursor(block.registry) as cr:
+        record_unused_ncf_numbers(cr, block.sequence_id, block.increment, [number])
+
+
+def add_pending_ncf_number(cr, key, block, number, journal_id, ncf):
+    """Keep track of a number handed out to the transaction of cr. It is given
+    back when the transaction is rolled back, or when it is committed without
+    a move using it, i.e. it was taken inside a savepoint rolled back later."""
+    pending = pending_ncf_numbers.get(cr)
+    if pending is None:
+        pending = pending_ncf_numbers[cr] = []
+        cr.after("commit", partial(give_back_unused_ncf_numbers, cr, block.registry))
+        cr.after("rollback", partial(give_back_pending_ncf_numbers, cr))
+    pending.append((key, block, number, journal_id, ncf))
+
+
+def give_back_pending_ncf_numbers(cr):
+    for key, block, number, journal_id, ncf in pending_ncf_numbers.pop(cr, []):
+        give_back_ncf_number(key, block, number)
+
+
+def give_back_unused_ncf_numbers(cr, registry):
+    """Called when the transaction that used reserved numbers is committed,
+    looks the moves up in a short transaction as the committed one is over"""
+    pending = pending_ncf_numbers.pop(cr, [])
+    by_journal = defaultdict(dict)
+    for item in pending:
+        by_journal[item[3]][item[4]] = item
+    unused = []
+    try:
+        with ncf_block_cursor(registry) as check_cr:
+            for journal_id, numbers in by_journal.items():
+                check_cr.execute(
+                    """
+                    SELECT ref
+                    FROM account_move
+                    WHERE journal_id = %s
+                    AND ref IN %s;
+                    """,
+                    (journal_id, tuple(numbers)),
+                )
+                used = {ref for ref, in check_cr.fetchall()}
+                unused.extend(item for ncf, item in numbers.items() if ncf not in used)
+        for key, block, number, journal_id, ncf in unused:
+            give_back_ncf_number(key, block, number)
+    except Exception:
+        _logger.exception("Could not give back the unused NCF numbers")
+
+
+def release_reserved_ncf_blocks(dbname=None, sequence_ids=None):
+    """Release the blocks reserved by this process, optionally only the ones of
+    a database and sequences"""
+    for key in list(reserved_ncf_blocks):
+        if (dbname and key[0] != dbname) or (
+            sequence_ids is not None and key[1] not in sequence_ids
+        ):
+            continue
+        with get_ncf_block_lock(key):
+            block = reserved_ncf_blocks.pop(key, None)
+            if not block:
+                continue
+            try:
+                release_ncf_block(block)
+            except Exception:
+                _logger.exception(
+                    "Could not release NCF block %s, it will be recovered"
+                    % block.block_id
+                )
+
+
+atexit.register(release_reserved_ncf_blocks)
+
+
+class L10nDoNcfBlock(models.Model):
+    """
+    Range of NCF numbers reserved from a fiscal sequence by a worker, which
+    hands them out without locking the sequence row. See
+    ir.sequence._l10n_do_next_reserved_number()
+    """
+
+    _name = "l10n_do.ncf.block"
+    _description = "Reserved NCF Block"
+    _order = "sequence_id, number_from"
+
+    sequence_id = fields.Many2one(
+        "ir.sequence",
+        required=True,
+        index=True,
+        ondelete="cascade",
+    )
+    number_from = fields.Integer(required=True)
+    number_to = fields.Integer(required=True)
+    state = fields.Selection(
+        selection=[
+            ("reserved", "Reserved"),
+            ("released", "Released"),
+            ("done", "Done"),
+        ],
+        required=True,
+        index=True,
+        default="reserved",
+        help="Reserved: numbers held by a worker.\n"
+        "Released: unused numbers to be reserved again.\n"
+        "Done: every number of the block has been used or released.",
+    )
+    owner = fields.Char(help="Host and process the block is reserved by")
+
+    @api.model
+    def _recover_abandoned_blocks(self):
+        """Record the unused numbers of the blocks reserved by workers that are
+        gone (i.e. crashed) so they can be reserved again"""
+        max_date = fields.Datetime.now() - timedelta(seconds=2 * NCF_BLOCK_TTL)
+        blocks = self.search(
+            [("state", "=", "reserved"), ("write_date", "<", max_date)]
+        )
+        for block in blocks:
+            sequence = block.sequence_id
+            increment = sequence.number_increment or 1
+            numbers = range(block.number_from, block.number_to + 1, increment)
+            ncf_numbers = {sequence.get_next_char(n): n for n in numbers}
+            self.env.cr.execute(
+                """
+                SELECT ref
+                FROM account_move
+                WHERE journal_id = %s
+                AND ref IN %s;
+                """,
+                (sequence.l10n_latam_journal_id.id, tuple(ncf_numbers)),
+            )
+            used = {ncf_numbers[ref] for ref, in self.env.cr.fetchall()}
+            block.write({"state": "done"})
+            record_unused_ncf_numbers(
+                self.env.cr,
+                sequence.id,
+                increment,
+                [n for n in numbers if n not in used],
+            )
+            _logger.info(
+                "Recovered abandoned NCF block %s-%s of sequence %s"
+                % (block.number_from, block.number_to, sequence.name)
+            )
+        self.env["ir.sequence"].invalidate_cache(
+            ["number_next", "number_next_actual", "l10n_do_ncf_released_blocks"]
+        )
@@ -0,0 +1,204 @@
+import io
+import logging
+import os
+import re
+import time
+
+from odoo import api, fields, models
+from odoo.tools import config, split_every
+
+_logger = logging.getLogger(__name__)
+
+# Lines of the registry file copied to the database at once
+RNC_REGISTRY_CHUNK_SIZE = 50000
+
+# Position of the fields in the DGII pipe-delimited registry file (DGII_RNC.TXT)
+RNC_REGISTRY_COLUMNS = (
+    ("rnc", 0),
+    ("name", 1),
+    ("trade_name", 2),
+    ("activity", 3),
+    ("status", 9),
+    ("payment_regime", 10),
+)
+RNC_REGISTRY_FIELDS = [name for name, position in RNC_REGISTRY_COLUMNS]
+
+# DGII payer type of the RNC by the economic activity or payment regime they
+# are registered with, checked in this order
+RNC_REGISTRY_PAYER_TYPES = [
+    ("governmental", re.compile("ADMINISTRACI[OÓ]N P[UÚ]BLICA|GOBIERNO|AYUNTAMIENTO")),
+    ("special", re.compile("ZONA[S]? FRANCA|RELIGIOS|IGLESIA|EMBAJADA|ORGANISMO")),
+    ("nonprofit", re.compile("SIN FINES DE LUCRO")),
+]
+
+
+def parse_rnc_registry_line(line):
+    """Return the registry values of a line as COPY text, None for the header
+    and malformed lines"""
+    values = line.rstrip("\r\n").split("|")
+    if len(values) <= RNC_REGISTRY_COLUMNS[-1][1]:
+        return None
+    rnc = values[0].strip().replace("-", "")
+    if not rnc.isdigit():
+        return None
+    row = [rnc] + [
+        values[position].strip() for name, position in RNC_REGISTRY_COLUMNS[1:]
+    ]
+    return "\t".join(v.replace("\\", "\\\\").replace("\t", " ") for v in row) + "\n"
+
+
+class L10nDoRncRegistry(models.Model):
+    """
+    Local copy of the DGII RNC registry, looked up by RNC or cédula. The
+    registry file is imported with import_registry_file(), or by the refresh
+    cron when l10n_do_rnc_registry_file in the server configuration points to
+    a new file.
+    """
+
+    _name = "l10n_do.rnc.registry"
+    _description = "DGII RNC Registry"
+    _order = "rnc"
+    _log_access = False
+
+    rnc = fields.Char(string="RNC/Cédula", required=True, readonly=True)
+    name = fields.Char(string="Legal Name", readonly=True)
+    trade_name = fields.Char(readonly=True)
+    activity = fields.Char(string="Economic Activity", readonly=True)
+    status = fields.Char(readonly=True)
+    payment_regime = fields.Char(readonly=True)
+
+    _sql_constraints = [
+        ("rnc_unique", "unique(rnc)", "RNC must be unique in the registry."),
+    ]
+
+    @api.model
+    def lookup(self, vats):
+        """
+        :param vats: RNC or cédulas
+        :return: {vat: {field: value}} of the ones in the registry
+        """
+        vats = tuple({vat for vat in vats if vat})
+        if not vats:
+            return {}
+        self.env.cr.execute(
+            "SELECT %s FROM l10n_do_rnc_registry WHERE rnc IN %%s"
+            % ", ".join(RNC_REGISTRY_FIELDS),
+            (vats,),
+        )
+        return {
+            row[0]: dict(zip(RNC_REGISTRY_FIELDS, row))
+            for row in self.env.cr.fetchall()
+        }
+
+    @api.model
+    def _get_dgii_payer_types(self, vats):
+        """
+        :param vats: RNC or cédulas
+        :return: {vat: payer type} of the RNC whose activity or payment regime
+        in the registry tells it, see RNC_REGISTRY_PAYER_TYPES
+        """
+        vats = [vat for vat in vats if vat and len(vat) == 9 and vat.isdigit()]
+        payer_types = {}
+        for vat, data in self.lookup(vats).items():
+            category = " ".join(
+                filter(None, (data["activity"], data["payment_regime"]))
+            ).upper()
+            for payer_type, pattern in RNC_REGISTRY_PAYER_TYPES:
+                if pattern.search(category):
+                    payer_types[vat] = payer_type
+                    break
+        return payer_types
+
+    @api.model
+    def import_registry_file(self, path, encoding="latin-1"):
+        """
+        Load the DGII registry file. It is copied to a temporary table in
+        chunks, then only new and changed RNC are written and the ones that
+        aren't in the file anymore are removed.
+
+        :return: number of RNC in the file
+        """
+        start = time.time()
+        cr = self.env.cr
+        self.flush()
+        cr.execute("DROP TABLE IF EXISTS l10n_do_rnc_registry_import")
+        cr.execute(
+            "CREATE TEMP TABLE l10n_do_rnc_registry_import (%s)"
+            % ", ".join("%s varchar" % name for name in RNC_REGISTRY_FIELDS)
+        )
+        with open(path, encoding=encoding, errors="replace") as registry_file:
+            for lines in split_every(RNC_REGISTRY_CHUNK_SIZE, registry_file):
+                buffer = io.StringIO(
+                    "".join(filter(None, map(parse_rnc_registry_line, lines)))
+                )
+                cr.copy_expert("COPY l10n_do_rnc_registry_import FROM STDIN", buffer)
+
+        cr.execute("SELECT COUNT(DISTINCT rnc) FROM l10n_do_rnc_registry_import")
+        count = cr.fetchone()[0]
+        if not count:
+            # Don't empty the registry because of a truncated or wrong file
+            _logger.warning("RNC registry %s has no RNC, it wasn't imported" % path)
+            cr.execute("DROP TABLE l10n_do_rnc_registry_import")
+            return 0
+
+        columns = ", ".join(RNC_REGISTRY_FIELDS)
+        values = ", ".join(RNC_REGISTRY_FIELDS[1:])
+        excluded = ", ".join("EXCLUDED.%s" % name for name in RNC_REGISTRY_FIELDS[1:])
+        cr.execute(
+            """
+            INSERT INTO l10n_do_rnc_registry (%s)
+            SELECT DISTINCT ON (rnc) %s
+            FROM l10n_do_rnc_registry_import
+            ORDER BY rnc
+            ON CONFLICT (rnc) DO UPDATE
+            SET (%s) = (%s)
+            WHERE (%s) IS DISTINCT FROM (%s);
+            """
+            % (
+                columns,
+                columns,
+                values,
+                excluded,
+                ", ".join(
+                    "l10n_do_rnc_registry.%s" % name
+                    for name in RNC_REGISTRY_FIELDS[1:]
+                ),
+                excluded,
+            )
+        )
+        changed = cr.rowcount
+        cr.execute(
+            """
+            DELETE FROM l10n_do_rnc_registry registry
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM l10n_do_rnc_registry_import imported
+                WHERE imported.rnc = registry.rnc
+            );
+            """
+        )
+        removed = cr.rowcount
+        cr.execute("DROP TABLE l10n_do_rnc_registry_import")
+        self.invalidate_cache()
+        _logger.info(
+            "Imported RNC registry %s: %s RNC, %s new or changed, %s removed in %.2fs"
+            % (path, count, changed, removed, time.time() - start)
+        )
+        return count
+
+    @api.model
+    def _refresh_registry(self):
+        """Import the registry file of the server configuration when it has
+        changed since the last import"""
+        path = config.get("l10n_do_rnc_registry_file")
+        if not path or not os.path.isfile(path):
+            return False
+        stat = os.stat(path)
+        signature = "%s-%s" % (stat.st_mtime, stat.st_size)
+        parameters = self.env["ir.config_parameter"].sudo()
+        key = "l10n_do_accounting.rnc_registry_signature"
+        if parameters.get_param(key) == signature:
+            return False
+        self.import_registry_file(path)
+        parameters.set_param(key, signature)
+        return True
@@ -1,4 +1,10 @@
-from odoo import models, fields
+import re
+
+from odoo import models, fields, api, tools, _
+from odoo.exceptions import UserError
+
+# Separators users type or paste inside a NCF
+NCF_SEPARATORS_RE = re.compile(r"[\s-]")
 
 
 class L10nLatamDocumentType(models.Model):
@@ -51,6 +57,23 @@ class L10nLatamDocumentType(models.Model):
         default=False,
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        # Journal NCF types and sequences are cached, see account.journal
+        self.clear_caches()
+        return res
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
+
     def _get_document_sequence_vals(self, journal):
         """ Values to create the sequences """
         values = super()._get_document_sequence_vals(journal)
@@ -68,6 +91,61 @@ class L10nLatamDocumentType(models.Model):
         )
         return values
 
+    @api.model
+    @tools.ormcache()
+    def _get_l10n_do_ncf_patterns(self):
+        """Return the compiled pattern of every NCF prefix: {prefix: (pattern,
+        digits)}. NCF are B + type code + 8 digits, e-NCF E + type code + 10
+        digits."""
+        patterns = {}
+        for ncf_type, code in self._get_l10n_do_ncf_types():
+            series, digits = ("E", 10) if ncf_type.startswith("e-") else ("B", 8)
+            prefix = series + code
+            patterns[prefix] = (re.compile(r"%s\d{%s}\Z" % (prefix, digits)), digits)
+        return patterns
+
+    def l10n_do_normalize_ncf_numbers(self, ncf_numbers):
+        """
+        Validate and normalize many NCF at once (i.e. on imports). Separators
+        are removed, letters are upper-cased and plain numbers get the prefix
+        and padding of the document type.
+
+        :param ncf_numbers: NCF to check against the prefix of this document
+        type or, when called on an empty recordset, against the one they have
+        :return: list of (ncf, error) in the same order, ncf being the
+        normalized NCF or False when it isn't valid
+        """
+        prefix = False
+        if self:
+            self.ensure_one()
+            prefix = self.doc_code_prefix
+        patterns = self._get_l10n_do_ncf_patterns()
+        if prefix and prefix not in patterns:
+            # Not a NCF (i.e. import dispatch numbers)
+            return [(number, False) for number in ncf_numbers]
+
+        results = []
+        for number in ncf_numbers:
+            ncf = NCF_SEPARATORS_RE.sub("", number or "").upper()
+            ncf_prefix = prefix or ncf[:3]
+            pattern, digits = patterns.get(ncf_prefix, (None, 0))
+            if not pattern:
+                results.append((False, _("%s is not a valid NCF type") % ncf[:3]))
+                continue
+            if ncf.isdigit() and len(ncf) <= digits:
+                ncf = ncf_prefix + ncf.zfill(digits)
+            if pattern.match(ncf):
+                results.append((ncf, False))
+            else:
+                results.append(
+                    (
+                        False,
+                        _("%s is not a valid NCF, it must be %s followed by %s digits")
+                        % (number, ncf_prefix, digits),
+                    )
+                )
+        return results
+
     def _format_document_number(self, document_number):
         """Make validation of Import Dispatch Number
         * making validations on the document_number.
@@ -80,4 +158,7 @@ class L10nLatamDocumentType(models.Model):
         if not document_number:
             return False
 
-        return document_number
+        ncf, error = self.l10n_do_normalize_ncf_numbers([document_number])[0]
+        if error:
+            raise UserError(error)
+        return ncf
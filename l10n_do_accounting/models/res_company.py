@@ -1,5 +1,7 @@
 from odoo import fields, models
 
+from .l10n_do_ncf_block import release_reserved_ncf_blocks
+
 
 class ResCompany(models.Model):
     _inherit = "res.company"
@@ -29,6 +31,25 @@ class ResCompany(models.Model):
         ),
     )
 
+    l10n_do_ncf_block_size = fields.Integer(
+        "NCF block size",
+        help="When greater than zero, each worker reserves blocks of this many "
+        "NCF and hands them out without locking the fiscal sequences while "
+        "invoices are posted. Unused numbers are given back to the sequences.",
+    )
+
+    def write(self, vals):
+        res = super().write(vals)
+        if "l10n_do_ecf_issuer" in vals:
+            # Journal NCF types depend on it, see account.journal
+            self.clear_caches()
+        if "l10n_do_ncf_block_size" in vals:
+            sequences = self.env["ir.sequence"].search(
+                [("company_id", "in", self.ids)]
+            )
+            release_reserved_ncf_blocks(self.env.cr.dbname, set(sequences.ids))
+        return res
+
     def _localization_use_documents(self):
         """ Dominican localization uses documents """
         self.ensure_one()
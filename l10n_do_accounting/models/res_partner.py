@@ -1,4 +1,108 @@
+import logging
+import operator
+import re
+
 from odoo import models, fields, api, _
+from odoo.exceptions import ValidationError
+
+_logger = logging.getLogger(__name__)
+
+try:
+    from stdnum.do import cedula, rnc
+except ImportError:
+    cedula = rnc = None
+    _logger.debug("Cannot import stdnum, RNC and cédula whitelists are unavailable")
+
+GOVERNMENTAL_NAME_RE = re.compile("MINISTERIO")
+SPECIAL_NAME_RE = re.compile("IGLESIA|ZONA FRANCA")
+
+VAT_SEPARATORS_RE = re.compile(r"[\s-]")
+# Same normalization in SQL, indexed, see Partner.init()
+VAT_NORMALIZED_SQL = r"regexp_replace(vat, '[\s-]', '', 'g')"
+VAT_DIGITS_RE = re.compile(r"[0-9]+")
+# Maps ASCII digits to their values, so a VAT is turned into digits in C
+VAT_DIGITS_TABLE = bytes.maketrans(b"0123456789", bytes(range(10)))
+# Weights of the first 8 digits of a RNC, the 9th one is the check digit
+RNC_WEIGHTS = (7, 9, 8, 6, 5, 4, 3, 2)
+# Sum of the digits of twice each digit, for the Luhn check of cédulas
+LUHN_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+# RNC and cédulas issued by DGII with a wrong check digit
+DGII_VAT_WHITELIST = frozenset(
+    (rnc.whitelist | cedula.whitelist) if rnc and cedula else ()
+)
+
+
+def check_dgii_vat(vat):
+    """
+    Check the check digit of a RNC (weighted modulo 11) or cédula (Luhn).
+
+    :param vat: VAT without separators
+    :return: True or False for RNC and cédulas, None for other identifiers
+    (i.e. passports). RNC and cédulas issued with a wrong check digit, see
+    DGII_VAT_WHITELIST, are valid.
+    """
+    if not VAT_DIGITS_RE.fullmatch(vat):
+        return None
+    if vat in DGII_VAT_WHITELIST:
+        return True
+    digits = vat.encode().translate(VAT_DIGITS_TABLE)
+    if len(digits) == 9:
+        total = sum(map(operator.mul, digits, RNC_WEIGHTS))
+        return (10 - total % 11) % 9 + 1 == digits[8]
+    if len(digits) == 11:
+        total = sum(digits[-1::-2]) + sum(map(LUHN_DOUBLED.__getitem__, digits[-2::-2]))
+        return not total % 10
+    return None
+
+
+def classify_dgii_payer_type(
+    partner_vat,
+    partner_name,
+    has_country,
+    is_dominican,
+    payer_type,
+    default_client,
+    registry_payer_type=None,
+):
+    """
+    Classify a partner by its VAT (or name, when it has no VAT) shape, its
+    country, the category of its RNC in the DGII registry and its name
+    keywords.
+
+    :return: (payer type, VAT), the payer type is None when the current one is
+    kept as is and the VAT is the name to be stored as VAT, if any
+    """
+    vat = str(partner_vat if partner_vat else partner_name)
+
+    if has_country and not is_dominican:
+        return "foreigner", None
+
+    if vat and (not payer_type or payer_type == "non_payer"):
+        if not (has_country and is_dominican):
+            return None, None
+        new_vat = None
+        if vat.isdigit() and len(vat) == 9:
+            if not partner_vat:
+                new_vat = vat
+            if registry_payer_type:
+                return registry_payer_type, new_vat
+            if partner_name and GOVERNMENTAL_NAME_RE.search(partner_name):
+                return "governmental", new_vat
+            if partner_name and SPECIAL_NAME_RE.search(partner_name):
+                return "special", new_vat
+            if vat.startswith("4"):
+                return "nonprofit", new_vat
+            return "taxpayer", new_vat
+        if len(vat) == 11 and vat.isdigit():
+            if not partner_vat:
+                new_vat = vat
+            return (
+                "taxpayer" if default_client == "fiscal" else "non_payer",
+                new_vat,
+            )
+        return "non_payer", None
+
+    return payer_type or "non_payer", None
 
 
 class Partner(models.Model):
@@ -64,57 +168,100 @@ class Partner(models.Model):
     @api.depends("vat", "country_id", "name")
     def _compute_l10n_do_dgii_payer_type(self):
         """ Compute the type of partner depending on soft decisions"""
-        company_id = self.env["res.company"].search(
-            [("id", "=", self.env.user.company_id.id)]
+        default_client = self.env.user.company_id.l10n_do_default_client
+        country_do = self.env.ref("base.do")
+        registry_payer_types = self.env["l10n_do.rnc.registry"]._get_dgii_payer_types(
+            [p.vat or p.name for p in self if p.country_id == country_do]
         )
+        vat_updates = []
         for partner in self:
-            vat = str(partner.vat if partner.vat else partner.name)
-            is_dominican_partner = bool(partner.country_id == self.env.ref("base.do"))
-
-            if partner.country_id and not is_dominican_partner:
-                partner.l10n_do_dgii_tax_payer_type = "foreigner"
-
-            elif vat and (
-                not partner.l10n_do_dgii_tax_payer_type
-                or partner.l10n_do_dgii_tax_payer_type == "non_payer"
-            ):
-                if partner.country_id and is_dominican_partner:
-                    if vat.isdigit() and len(vat) == 9:
-                        if not partner.vat:
-                            partner.vat = vat
-                        if partner.name and "MINISTERIO" in partner.name:
-                            partner.l10n_do_dgii_tax_payer_type = "governmental"
-                        elif partner.name and any(
-                            [n for n in ("IGLESIA", "ZONA FRANCA") if n in partner.name]
-                        ):
-                            partner.l10n_do_dgii_tax_payer_type = "special"
-                        elif vat.startswith("1"):
-                            partner.l10n_do_dgii_tax_payer_type = "taxpayer"
-                        elif vat.startswith("4"):
-                            partner.l10n_do_dgii_tax_payer_type = "nonprofit"
-                        else:
-                            partner.l10n_do_dgii_tax_payer_type = "taxpayer"
-
-                    elif len(vat) == 11:
-                        if vat.isdigit():
-                            if not partner.vat:
-                                partner.vat = vat
-                            payer_type = (
-                                "taxpayer"
-                                if company_id.l10n_do_default_client == "fiscal"
-                                else "non_payer"
-                            )
-                            partner.l10n_do_dgii_tax_payer_type = payer_type
-                        else:
-                            partner.l10n_do_dgii_tax_payer_type = "non_payer"
-                    else:
-                        partner.l10n_do_dgii_tax_payer_type = "non_payer"
-            elif not partner.l10n_do_dgii_tax_payer_type:
-                partner.l10n_do_dgii_tax_payer_type = "non_payer"
-            else:
-                partner.l10n_do_dgii_tax_payer_type = (
-                    partner.l10n_do_dgii_tax_payer_type
+            payer_type, vat = classify_dgii_payer_type(
+                partner.vat,
+                partner.name,
+                bool(partner.country_id),
+                partner.country_id == country_do,
+                partner.l10n_do_dgii_tax_payer_type,
+                default_client,
+                registry_payer_types.get(partner.vat or partner.name),
+            )
+            # Only names that are valid RNC or cédulas are copied to the VAT
+            if vat and check_dgii_vat(vat) is not False:
+                vat_updates.append((partner, vat))
+            if payer_type:
+                partner.l10n_do_dgii_tax_payer_type = payer_type
+
+        for partner, vat in vat_updates:
+            partner.vat = vat
+
+    @api.onchange("vat")
+    def _onchange_l10n_do_vat_registry(self):
+        """Fill the name of the partner from the DGII RNC registry and warn
+        about RNC that aren't active"""
+        if not self.vat:
+            return
+        vat = self.vat.replace("-", "")
+        data = self.env["l10n_do.rnc.registry"].lookup([vat]).get(vat)
+        if not data:
+            return
+        if not self.name:
+            self.name = data["name"]
+        if data["status"] and data["status"].upper() != "ACTIVO":
+            return {
+                "warning": {
+                    "title": _("RNC not active"),
+                    "message": _("RNC %s of %s is %s in the DGII registry")
+                    % (self.vat, data["name"], data["status"]),
+                }
+            }
+
+    @api.model
+    def l10n_do_validate_vats(self, vats):
+        """
+        Validate and normalize many RNC and cédulas at once (i.e. on imports).
+        Separators are removed and the check digit of 9 and 11 digits VAT is
+        verified, other identifiers are returned as they are.
+
+        :param vats: list of VAT
+        :return: list of (vat, error) in the same order, vat being the
+        normalized VAT or False when it isn't valid
+        """
+        results = []
+        for number in vats:
+            vat = VAT_SEPARATORS_RE.sub("", number or "")
+            if check_dgii_vat(vat) is False:
+                results.append(
+                    (
+                        False,
+                        _("%s is not a valid %s, its check digit is wrong")
+                        % (number, _("RNC") if len(vat) == 9 else _("Cédula")),
+                    )
                 )
+            else:
+                results.append((vat or False, False))
+        return results
+
+    def init(self):
+        self.env.cr.execute(
+            """
+            CREATE INDEX IF NOT EXISTS res_partner_l10n_do_vat_index
+            ON res_partner (({vat}))
+            WHERE vat IS NOT NULL;
+            """.format(
+                vat=VAT_NORMALIZED_SQL
+            )
+        )
+
+    @api.constrains("vat", "country_id")
+    def _check_l10n_do_vat(self):
+        country_do = self.env.ref("base.do")
+        partners = self.filtered(lambda p: p.vat and p.country_id == country_do)
+        errors = [
+            error
+            for vat, error in self.l10n_do_validate_vats(partners.mapped("vat"))
+            if error
+        ]
+        if errors:
+            raise ValidationError("\n".join(errors))
 
     def _inverse_l10n_do_dgii_tax_payer_type(self):
         for partner in self:
@@ -1 +1,8 @@
 from . import test_account_move
+from . import test_electronic_stamp
+from . import test_l10n_latam_document_type
+from . import test_vendor_bill_import
+from . import test_res_partner
+from . import test_rnc_registry
+from . import test_migration
+from . import test_ncf_block
@@ -1,4 +1,8 @@
+import tempfile
+from unittest.mock import patch
+
 from odoo import tools
+from odoo.exceptions import UserError, ValidationError
 from odoo.tests.common import TransactionCase
 from odoo.modules.module import get_module_resource
 
@@ -44,11 +48,11 @@ class AccountMoveTest(TransactionCase):
         # Demo product
         self.product = self.env.ref("product.product_product_4")
 
-    def create_invoice(self, invoice_type):
+    def create_invoice(self, invoice_type, post=True, partner=None, price_unit=110.0):
         inv = self.env["account.move"].create(
             {
                 "type": invoice_type,
-                "partner_id": self.partner.id,
+                "partner_id": (partner or self.partner).id,
                 "invoice_line_ids": [
                     (
                         0,
@@ -56,13 +60,14 @@ class AccountMoveTest(TransactionCase):
                         {
                             "product_id": self.product.id,
                             "quantity": 1,
-                            "price_unit": 110.0,
+                            "price_unit": price_unit,
                         },
                     )
                 ],
             }
         )
-        inv.post()
+        if post:
+            inv.post()
         return inv
 
     def test_001_account_move_cancel(self):
@@ -115,3 +120,328 @@ class AccountMoveTest(TransactionCase):
         )
 
         self.assertEqual(move.button_cancel(), None)
+
+    def test_003_account_move_batch_post(self):
+        """
+        Check invoices posted in batch get consecutive NCFs and every chunk
+        is reported
+        """
+
+        invoices = self.env["account.move"]
+        for _i in range(5):
+            invoices |= self.create_invoice("out_invoice", post=False)
+
+        stats = invoices.l10n_do_batch_post(chunk_size=2)
+
+        self.assertEqual(set(invoices.mapped("state")), {"posted"})
+        self.assertEqual(len(set(invoices.mapped("ref"))), 5)
+        self.assertEqual([s["count"] for s in stats], [2, 2, 1])
+        sequence = invoices[0].l10n_latam_sequence_id
+        self.assertEqual(
+            invoices[-1].ref, sequence.get_next_char(sequence.number_next_actual - 1)
+        )
+
+    def test_004_account_move_document_type_errors(self):
+        """
+        Check every invoice not meeting its document type requirements is
+        reported
+        """
+
+        partner = self.env["res.partner"].create(
+            {"name": "Consumer", "country_id": self.env.ref("base.do").id}
+        )
+        invoices = self.env["account.move"]
+        for _i in range(3):
+            invoices |= self.create_invoice(
+                "out_invoice", post=False, partner=partner, price_unit=300000.0
+            )
+        invoices |= self.create_invoice("out_invoice", post=False)
+
+        errors = invoices._l10n_do_get_document_type_errors()
+
+        self.assertEqual([invoice for invoice, r, m in errors], list(invoices[:3]))
+        self.assertEqual({r for i, r, m in errors}, {"amount_requires_vat"})
+
+    def test_005_account_move_bulk_cancel(self):
+        """
+        Check many fiscal invoices are cancelled at once with the cancel wizard
+        """
+
+        invoices = self.env["account.move"]
+        for _i in range(3):
+            invoices |= self.create_invoice("out_invoice")
+
+        action = invoices.button_cancel()
+        self.assertEqual(action["context"]["active_ids"], invoices.ids)
+
+        wizard = (
+            self.env["account.move.cancel"]
+            .with_context(active_ids=invoices.ids)
+            .create({"l10n_do_cancellation_type": "01"})
+        )
+        wizard.move_cancel()
+
+        self.assertEqual(set(invoices.mapped("state")), {"cancel"})
+        self.assertEqual(set(invoices.mapped("l10n_do_cancellation_type")), {"01"})
+
+    def test_006_account_move_batch_reverse(self):
+        """
+        Check the credit notes of many invoices are issued at once
+        """
+
+        invoices = self.env["account.move"]
+        for _i in range(3):
+            invoices |= self.create_invoice("out_invoice")
+
+        credit_notes = invoices.l10n_do_batch_reverse(
+            refund_type="percentage", percentage=10, reason="Rebate"
+        )
+
+        self.assertEqual(len(credit_notes), 3)
+        self.assertEqual(set(credit_notes.mapped("type")), {"out_refund"})
+        self.assertEqual(
+            credit_notes.mapped("l10n_do_origin_ncf"),
+            invoices.mapped("l10n_latam_document_number"),
+        )
+        self.assertEqual(
+            credit_notes.mapped("invoice_line_ids.price_unit"), [11.0, 11.0, 11.0]
+        )
+
+    def test_007_dgii_report(self):
+        """
+        Check the 607 report has a line for every posted fiscal invoice
+        """
+
+        invoices = self.env["account.move"]
+        for _i in range(2):
+            invoices |= self.create_invoice("out_invoice")
+
+        report = self.env["l10n_do.dgii.report"].create(
+            {
+                "report_type": "607",
+                "date_from": invoices[0].invoice_date,
+                "date_to": invoices[0].invoice_date,
+            }
+        )
+        with tempfile.TemporaryFile() as fileobj:
+            count = report._write_report(fileobj)
+            fileobj.seek(0)
+            lines = fileobj.read().decode().splitlines()
+
+        self.assertEqual(count, len(lines) - 1)
+        self.assertTrue(lines[0].startswith("607|131793916|"))
+        rows = [line.split("|") for line in lines[1:]]
+        for invoice in invoices:
+            row = next(row for row in rows if row[2] == invoice.ref)
+            self.assertEqual(len(row), 23)
+            self.assertEqual(row[:2], ["40229590076", "2"])
+            self.assertEqual(row[5], invoice.invoice_date.strftime("%Y%m%d"))
+            self.assertEqual(row[7], "110.00")
+
+        report.action_generate()
+        path = report._get_report_path()
+        with open(path, "rb") as fileobj:
+            self.assertEqual(len(fileobj.read().decode().splitlines()), len(lines))
+
+    def test_008_fiscal_summary(self):
+        """
+        Check the fiscal summary report follows posted and cancelled invoices
+        before the summary is compacted, and matches a rebuild
+        """
+
+        summary = self.env["l10n_do.fiscal.summary"]
+        report = self.env["l10n_do.fiscal.summary.report"]
+
+        def totals():
+            report.invalidate_cache()
+            return {
+                (
+                    s.date,
+                    s.l10n_latam_document_type_id.id,
+                    s.l10n_do_income_type,
+                ): (s.move_count, s.cancelled_count, s.amount_untaxed)
+                for s in report.search([])
+            }
+
+        summary.rebuild()
+        before = totals()
+        invoices = self.env["account.move"]
+        for _i in range(3):
+            invoices |= self.create_invoice("out_invoice")
+        invoices[0]._l10n_do_cancel_invoices("01")
+
+        after = totals()
+        key = (
+            invoices[0].invoice_date.replace(day=1),
+            invoices[0].l10n_latam_document_type_id.id,
+            invoices[0].l10n_do_income_type,
+        )
+        count, cancelled, amount = before.get(key, (0, 0, 0.0))
+        self.assertEqual(after[key], (count + 2, cancelled + 1, amount + 220.0))
+        summary._compact()
+        self.assertEqual(totals(), after)
+
+        summary.rebuild()
+        self.assertEqual(totals(), after)
+
+        # Fiscal fields of posted invoices are tracked too
+        income_type = "02" if invoices[1].l10n_do_income_type != "02" else "03"
+        invoices[1].write({"l10n_do_income_type": income_type})
+        changed = totals()
+        self.assertNotEqual(changed, after)
+        summary.rebuild()
+        self.assertEqual(totals(), changed)
+
+    def test_009_itbis_amount(self):
+        """
+        Check the ITBIS of e-CF invoice lines only counts ITBIS taxes and is
+        computed again for the changed line only
+        """
+
+        itbis = self.env["account.tax"].create(
+            {
+                "name": "ITBIS 18%",
+                "amount": 18,
+                "type_tax_use": "sale",
+                "tax_group_id": self.env.ref("l10n_do.group_itbis").id,
+            }
+        )
+        other = self.env["account.tax"].create(
+            {"name": "Other 10%", "amount": 10, "type_tax_use": "sale"}
+        )
+        journal = self.journal_obj.search(
+            [("type", "=", "sale"), ("l10n_latam_use_documents", "=", True)], limit=1
+        )
+        invoice = self.env["account.move"].create(
+            {
+                "type": "out_invoice",
+                "journal_id": journal.id,
+                "partner_id": self.partner.id,
+                "l10n_latam_document_type_id": self.env.ref(
+                    "l10n_do_accounting.ecf_fiscal_client"
+                ).id,
+                "invoice_line_ids": [
+                    (
+                        0,
+                        0,
+                        {
+                            "product_id": self.product.id,
+                            "quantity": quantity,
+                            "price_unit": 100.0,
+                            "tax_ids": [(6, 0, taxes.ids)],
+                        },
+                    )
+                    for quantity, taxes in (
+                        (1, itbis),
+                        (2, itbis | other),
+                        (1, other),
+                        (1, itbis),
+                    )
+                ],
+            }
+        )
+
+        self.assertTrue(invoice.is_ecf_invoice)
+        lines = invoice.invoice_line_ids.with_context(check_move_validity=False)
+        self.assertEqual(lines.mapped("l10n_do_itbis_amount"), [18.0, 36.0, 0.0, 18.0])
+        lines[0].quantity = 3
+        self.assertEqual(lines[0].l10n_do_itbis_amount, 54.0)
+
+        # Only the changed line is computed again
+        AccountMoveLine = type(self.env["account.move.line"])
+        compute = AccountMoveLine._compute_l10n_do_itbis_amount
+        computed = []
+
+        def compute_spy(records):
+            computed.append(records)
+            return compute(records)
+
+        with patch.object(
+            AccountMoveLine, "_compute_l10n_do_itbis_amount", compute_spy
+        ):
+            lines[1].price_unit = 200.0
+            self.assertEqual(
+                lines.mapped("l10n_do_itbis_amount"), [54.0, 72.0, 0.0, 18.0]
+            )
+            self.assertEqual(computed, [lines[1]])
+
+            computed.clear()
+            lines[2].tax_ids = itbis
+            self.assertEqual(
+                lines.mapped("l10n_do_itbis_amount"), [54.0, 72.0, 18.0, 18.0]
+            )
+            self.assertEqual(computed, [lines[2]])
+
+    def test_010_vendor_ncf_unique(self):
+        """
+        Check vendor NCF are unique inside a batch and bills without vendor
+        are checked too
+        """
+
+        document_type = self.env.ref("l10n_do_accounting.ncf_fiscal_client")
+        vals = {
+            "type": "in_invoice",
+            "partner_id": self.partner.id,
+            "l10n_latam_document_type_id": document_type.id,
+            "ref": "B0100000001",
+        }
+        with self.assertRaises(ValidationError):
+            self.env["account.move"].create([vals, dict(vals)])
+
+        minor_type = self.env.ref("l10n_do_accounting.ncf_minor_supplier")
+        vals = {
+            "type": "in_invoice",
+            "l10n_latam_document_type_id": minor_type.id,
+            "ref": "B1300000001",
+        }
+        bill = self.env["account.move"].create(vals)
+        self.assertFalse(bill.commercial_partner_id)
+        with self.assertRaises(ValidationError):
+            self.env["account.move"].create(dict(vals))
+
+    def test_011_account_move_batch_reverse_cancel(self):
+        """
+        Check credit notes issued in cancel mode are posted with their NCF and
+        reconciled with their invoice
+        """
+
+        invoices = self.env["account.move"]
+        for _i in range(2):
+            invoices |= self.create_invoice("out_invoice")
+
+        credit_notes = invoices.l10n_do_batch_reverse(cancel=True)
+
+        self.assertEqual(set(credit_notes.mapped("state")), {"posted"})
+        self.assertEqual(len(set(credit_notes.mapped("ref"))), 2)
+        self.assertEqual(set(invoices.mapped("invoice_payment_state")), {"paid"})
+
+    def test_012_document_number_onchange(self):
+        """
+        Check an invalid NCF typed on the form returns a warning, while a
+        valid one is normalized. The error is raised when saving.
+        """
+
+        bill = self.create_invoice("in_invoice", post=False)
+        document_type = self.env.ref("l10n_do_accounting.ncf_fiscal_client")
+        form = self.env["account.move"].new(
+            {
+                "type": "in_invoice",
+                "journal_id": bill.journal_id.id,
+                "partner_id": self.partner.id,
+                "l10n_latam_document_type_id": document_type.id,
+                "l10n_latam_document_number": "B01",
+            }
+        )
+        self.assertIn("warning", form._onchange_l10n_latam_document_number())
+
+        form.l10n_latam_document_number = "b01-00000025"
+        self.assertFalse(form._onchange_l10n_latam_document_number())
+        self.assertEqual(form.ref, "B0100000025")
+
+        with self.assertRaises(UserError):
+            bill.write(
+                {
+                    "l10n_latam_document_type_id": document_type.id,
+                    "l10n_latam_document_number": "B01",
+                }
+            )
@@ -0,0 +1,93 @@
+import logging
+import time
+from datetime import date, datetime
+
+from werkzeug import urls
+
+from odoo.tests.common import TransactionCase, tagged
+
+from ..models.account_move import get_l10n_do_electronic_stamp
+
+_logger = logging.getLogger(__name__)
+
+
+class ElectronicStampTest(TransactionCase):
+    def test_001_electronic_stamp(self):
+        """
+        Check e-CF stamp URL contains every DGII parameter, sign date in
+        Santo Domingo time
+        """
+
+        stamp = get_l10n_do_electronic_stamp(
+            "CerteCF",
+            "131793916",
+            "40229590076",
+            "E310000000001",
+            date(2020, 9, 1),
+            1180.5,
+            "Ab12Cd",
+            datetime(2020, 9, 1, 16, 30, 5),
+        )
+        self.assertEqual(
+            urls.url_unquote_plus(stamp),
+            "https://ecf.dgii.gov.do/CerteCF/ConsultaTimbre?"
+            "RncEmisor=131793916&RncComprador=40229590076&ENCF=E310000000001&"
+            "FechaEmision=01-09-2020&MontoTotal=1180.5&"
+            "FechaFirma=01-09-2020 12:30:05&CodigoSeguridad=Ab12Cd",
+        )
+
+    def test_002_electronic_stamp_without_buyer_and_sign_date(self):
+        """
+        Check e-CF stamp URL skips RncComprador and FechaFirma when they
+        are not given
+        """
+
+        stamp = get_l10n_do_electronic_stamp(
+            "eCF",
+            "131793916",
+            None,
+            "E430000000001",
+            date(2020, 9, 1),
+            500.0,
+            "Ab12Cd",
+        )
+        self.assertEqual(
+            urls.url_unquote_plus(stamp),
+            "https://ecf.dgii.gov.do/eCF/ConsultaTimbre?"
+            "RncEmisor=131793916&ENCF=E430000000001&"
+            "FechaEmision=01-09-2020&MontoTotal=500&CodigoSeguridad=Ab12Cd",
+        )
+
+
+@tagged("-standard", "l10n_do_benchmark")
+class ElectronicStampBenchmarkTest(TransactionCase):
+    """Opt-in, run with --test-tags l10n_do_benchmark"""
+
+    def test_001_electronic_stamp_batch(self):
+        """
+        Check stamps built in bulk are different for every e-CF, logging how
+        many are built per second
+        """
+
+        count = 20000
+        issue_date = date(2020, 9, 1)
+        sign_date = datetime(2020, 9, 1, 16, 30, 5)
+        start = time.time()
+        stamps = {
+            get_l10n_do_electronic_stamp(
+                "eCF",
+                "131793916",
+                "40229590076",
+                "E31%010d" % i,
+                issue_date,
+                1180.5 + i,
+                "Ab12Cd",
+                sign_date,
+            )
+            for i in range(count)
+        }
+        _logger.info(
+            "Built %.0f e-CF stamps per second"
+            % (count / max(time.time() - start, 1e-6))
+        )
+        self.assertEqual(len(stamps), count)
@@ -0,0 +1,31 @@
+from odoo.exceptions import UserError
+from odoo.tests.common import TransactionCase
+
+
+class DocumentTypeTest(TransactionCase):
+    def test_001_normalize_ncf_numbers(self):
+        """
+        Check NCF are validated and normalized against their prefix
+        """
+
+        results = self.env["l10n_latam.document.type"].l10n_do_normalize_ncf_numbers(
+            ["b01-00000001", "E310000000001", "B0100001", "X0100000001", ""]
+        )
+
+        self.assertEqual(results[0], ("B0100000001", False))
+        self.assertEqual(results[1], ("E310000000001", False))
+        self.assertEqual([ncf for ncf, error in results[2:]], [False] * 3)
+        self.assertTrue(all(error for ncf, error in results[2:]))
+
+    def test_002_format_document_number(self):
+        """
+        Check document types pad plain numbers and refuse malformed NCF
+        """
+
+        document_type = self.env.ref("l10n_do_accounting.ncf_consumer_supplier")
+
+        self.assertEqual(document_type._format_document_number("25"), "B0200000025")
+        with self.assertRaises(UserError):
+            document_type._format_document_number("B0100000025")
+        with self.assertRaises(UserError):
+            document_type._format_document_number("B02000000025")
@@ -0,0 +1,114 @@
+from unittest.mock import patch
+
+from odoo import tools
+from odoo.tests.common import TransactionCase
+from odoo.modules.module import get_module_resource
+
+from ..migration import (
+    create_checkpoint_table,
+    get_checkpoint,
+    migrate_company,
+    set_checkpoint,
+)
+
+
+class MigrationTest(TransactionCase):
+    def setUp(self):
+        super(MigrationTest, self).setUp()
+
+        tools.convert_file(
+            self.cr,
+            "l10n_do_accounting",
+            get_module_resource("account", "test", "account_minimal_test.xml"),
+            {},
+            "init",
+            False,
+            "test",
+            self.registry._assertion_report,
+        )
+        self.company = self.env.user.company_id
+        self.company.write(
+            {"vat": "131793916", "country_id": self.env.ref("base.do").id}
+        )
+
+        # v12 tables and columns the migration reads from
+        self.cr.execute(
+            """
+            CREATE TABLE account_invoice (
+                move_name VARCHAR,
+                reference VARCHAR,
+                state VARCHAR,
+                company_id INTEGER,
+                income_type VARCHAR,
+                expense_type VARCHAR,
+                anulation_type VARCHAR,
+                origin_out VARCHAR
+            );
+            ALTER TABLE account_journal ADD COLUMN purchase_type VARCHAR;
+            """
+        )
+        create_checkpoint_table(self.cr)
+
+        self.journal = (
+            self.env["account.move"]
+            .with_context(default_type="out_invoice")
+            ._get_default_journal()
+        )
+        partner = self.env["res.partner"].create({"name": "Jimmy"})
+        self.moves = self.env["account.move"]
+        for _i in range(3):
+            self.moves |= self.env["account.move"].create(
+                {
+                    "type": "out_invoice",
+                    "journal_id": self.journal.id,
+                    "partner_id": partner.id,
+                }
+            )
+        self.env["account.move"].flush()
+        for i, move in enumerate(self.moves, 1):
+            self.cr.execute(
+                """
+                UPDATE account_move
+                SET name = %s, ref = NULL, l10n_latam_document_type_id = NULL
+                WHERE id = %s;
+                INSERT INTO account_invoice
+                (move_name, reference, state, company_id, income_type)
+                VALUES (%s, %s, 'open', %s, '01');
+                """,
+                (
+                    "INV/%s" % i,
+                    move.id,
+                    "INV/%s" % i,
+                    "B010000000%s" % i,
+                    self.company.id,
+                ),
+            )
+        self.env["account.move"].invalidate_cache()
+
+    def test_001_resume_interrupted_company(self):
+        """
+        Check an interrupted company migration resumes after the last
+        checkpointed chunk and marks the journal as done
+        """
+        with patch.object(self.cr, "commit") as commit:
+            # Interrupted after migrating the chunk of the first move
+            set_checkpoint(
+                self.cr, "invoices", self.company.id, self.journal.id, self.moves[0].id
+            )
+            migrate_company(self.env, self.company, chunk_size=1)
+
+        self.assertTrue(commit.called)
+        fiscal_client = self.env.ref("l10n_do_accounting.ncf_fiscal_client")
+        self.assertFalse(self.moves[0].l10n_latam_document_type_id)
+        self.assertEqual(
+            self.moves[1:].mapped("l10n_latam_document_type_id"), fiscal_client
+        )
+        self.assertEqual(
+            self.moves[1:].mapped("ref"), ["B0100000002", "B0100000003"]
+        )
+        self.assertEqual(
+            get_checkpoint(self.cr, "invoices", self.company.id, self.journal.id),
+            (0, True),
+        )
+        self.journal.invalidate_cache()
+        self.assertTrue(self.journal.l10n_latam_use_documents)
@@ -0,0 +1,174 @@
+from odoo import tools
+from odoo.exceptions import UserError
+from odoo.tests.common import TransactionCase
+from odoo.modules.module import get_module_resource
+
+from ..models.l10n_do_ncf_block import (
+    give_back_pending_ncf_numbers,
+    give_back_unused_ncf_numbers,
+    pending_ncf_numbers,
+    release_reserved_ncf_blocks,
+    reserved_ncf_blocks,
+)
+
+
+class NcfBlockTest(TransactionCase):
+    def setUp(self):
+        super(NcfBlockTest, self).setUp()
+
+        tools.convert_file(
+            self.cr,
+            "l10n_do_accounting",
+            get_module_resource("account", "test", "account_minimal_test.xml"),
+            {},
+            "init",
+            False,
+            "test",
+            self.registry._assertion_report,
+        )
+        self.company = self.env.user.company_id
+        self.company.write(
+            {"vat": "131793916", "country_id": self.env.ref("base.do").id}
+        )
+        journal = self.env["account.journal"].search(
+            [("type", "=", "sale"), ("company_id", "=", self.company.id)], limit=1
+        )
+        journal.l10n_latam_use_documents = True
+        fiscal_client = self.env.ref("l10n_do_accounting.ncf_fiscal_client")
+        self.sequence = journal.l10n_do_sequence_ids.filtered(
+            lambda s: s.l10n_latam_document_type_id == fiscal_client
+        )
+        self.key = (self.cr.dbname, self.sequence.id)
+        self.number = self.sequence.number_next
+        self.env["ir.sequence"].flush()
+
+        # Blocks are reserved in short transactions, run them inside the test one
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        self.addCleanup(self._release_blocks)
+
+    def _release_blocks(self):
+        pending_ncf_numbers.pop(self.cr, None)
+        release_reserved_ncf_blocks(self.cr.dbname)
+
+    def _get_blocks(self, state):
+        return self.env["l10n_do.ncf.block"].search(
+            [("sequence_id", "=", self.sequence.id), ("state", "=", state)]
+        )
+
+    def test_001_reserve_block(self):
+        """
+        Check a block of numbers is taken from the sequence at once and its
+        numbers are handed out one after another
+        """
+        self.company.l10n_do_ncf_block_size = 10
+
+        self.assertEqual(
+            self.sequence._next(), self.sequence.get_next_char(self.number)
+        )
+        self.assertEqual(
+            self.sequence._next(), self.sequence.get_next_char(self.number + 1)
+        )
+        self.assertEqual(self.sequence.number_next, self.number + 10)
+        block = self._get_blocks("reserved")
+        self.assertEqual(len(block), 1)
+        self.assertEqual(
+            (block.number_from, block.number_to), (self.number, self.number + 9)
+        )
+
+    def test_002_give_back_on_rollback(self):
+        """
+        Check the numbers of a rolled back transaction are handed out again
+        """
+        self.company.l10n_do_ncf_block_size = 10
+        ncf = self.sequence._next()
+
+        # What the rollback of the transaction runs
+        give_back_pending_ncf_numbers(self.cr)
+
+        self.assertEqual(self.sequence._next(), ncf)
+
+    def test_003_give_back_on_rolled_back_savepoint(self):
+        """
+        Check a number taken inside a rolled back savepoint is handed out again
+        once the transaction is committed, as no move uses it
+        """
+        self.company.l10n_do_ncf_block_size = 10
+        self.sequence._next()
+        with self.assertRaises(UserError), self.cr.savepoint():
+            ncf = self.sequence._next()
+            raise UserError("Rolled back")
+
+        # What the commit of the transaction runs
+        give_back_unused_ncf_numbers(self.cr, self.registry)
+
+        self.assertEqual(self.sequence._next(), ncf)
+
+    def test_004_give_back_unused_numbers(self):
+        """
+        Check the unused numbers of a released block are given back to the
+        sequence when they are the last ones it handed out
+        """
+        self.company.l10n_do_ncf_block_size = 10
+        self.sequence._next()
+
+        release_reserved_ncf_blocks(self.cr.dbname)
+
+        self.sequence.invalidate_cache()
+        self.assertEqual(self.sequence.number_next, self.number + 1)
+        self.assertEqual(len(self._get_blocks("done")), 1)
+        self.assertFalse(self._get_blocks("released"))
+        self.assertFalse(self.sequence.l10n_do_ncf_released_blocks)
+
+    def test_005_released_blocks(self):
+        """
+        Check unused numbers that can't go back to the sequence are recorded as
+        a released block, handed out even when blocks are disabled
+        """
+        self.company.l10n_do_ncf_block_size = 10
+        self.sequence._next()
+        # Another worker reserves the next block
+        self.cr.execute(
+            "UPDATE ir_sequence SET number_next = number_next + 10 WHERE id = %s",
+            (self.sequence.id,),
+        )
+
+        self.company.l10n_do_ncf_block_size = 0
+
+        self.sequence.invalidate_cache()
+        released = self._get_blocks("released")
+        self.assertEqual(
+            (released.number_from, released.number_to),
+            (self.number + 1, self.number + 9),
+        )
+        self.assertTrue(self.sequence.l10n_do_ncf_released_blocks)
+
+        self.assertEqual(
+            self.sequence._next(), self.sequence.get_next_char(self.number + 1)
+        )
+        released.invalidate_cache()
+        self.assertEqual(released.state, "reserved")
+        self.assertEqual(self.sequence.number_next, self.number + 20)
+
+    def test_006_recover_abandoned_blocks(self):
+        """
+        Check the unused numbers of a block whose worker is gone are given back
+        """
+        self.company.l10n_do_ncf_block_size = 10
+        self.sequence._next()
+        # The worker crashes
+        reserved_ncf_blocks.pop(self.key)
+        pending_ncf_numbers.pop(self.cr)
+        self.cr.execute(
+            """
+            UPDATE l10n_do_ncf_block
+            SET write_date = (now() at time zone 'UTC') - interval '3 hours'
+            WHERE sequence_id = %s;
+            """,
+            (self.sequence.id,),
+        )
+
+        self.env["l10n_do.ncf.block"]._recover_abandoned_blocks()
+
+        self.assertEqual(len(self._get_blocks("done")), 1)
+        self.assertEqual(self.sequence.number_next, self.number)
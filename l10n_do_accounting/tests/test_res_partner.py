@@ -0,0 +1,78 @@
+from odoo.exceptions import ValidationError
+from odoo.tests.common import TransactionCase
+
+
+class PartnerTest(TransactionCase):
+    def test_001_dgii_payer_type(self):
+        """
+        Check partners created in batch are classified by VAT, name and country
+        """
+
+        country_do = self.env.ref("base.do").id
+        self.env.user.company_id.write(
+            {"country_id": country_do, "l10n_do_default_client": "non_payer"}
+        )
+        partners = self.env["res.partner"].create(
+            [
+                {"name": "Company", "vat": "131793916", "country_id": country_do},
+                {"name": "Foundation", "vat": "430012343", "country_id": country_do},
+                {"name": "MINISTERIO DE HACIENDA", "vat": "401007551"},
+                {"name": "IGLESIA CATOLICA", "vat": "430003212"},
+                {"name": "Jimmy", "vat": "40229590076", "country_id": country_do},
+                {"name": "131793916", "country_id": country_do},
+                {"name": "Consumer", "country_id": country_do},
+                {"name": "Abroad", "country_id": self.env.ref("base.us").id},
+            ]
+        )
+
+        self.assertEqual(
+            partners.mapped("l10n_do_dgii_tax_payer_type"),
+            [
+                "taxpayer",
+                "nonprofit",
+                "governmental",
+                "special",
+                "non_payer",
+                "taxpayer",
+                "non_payer",
+                "foreigner",
+            ],
+        )
+        self.assertEqual(partners[5].vat, "131793916")
+
+    def test_002_validate_vats(self):
+        """
+        Check RNC and cédulas are validated by their check digit
+        """
+
+        Partner = self.env["res.partner"]
+        self.assertEqual(
+            Partner.l10n_do_validate_vats(
+                ["131793916", "402-2959007-6", "PA1234567", False]
+            ),
+            [
+                ("131793916", False),
+                ("40229590076", False),
+                ("PA1234567", False),
+                (False, False),
+            ],
+        )
+        results = Partner.l10n_do_validate_vats(["131793917", "40229590077"])
+        self.assertEqual([vat for vat, error in results], [False, False])
+        self.assertTrue(all(error for vat, error in results))
+
+        country_do = self.env.ref("base.do").id
+        with self.assertRaises(ValidationError):
+            Partner.create(
+                {"name": "Wrong", "vat": "131793917", "country_id": country_do}
+            )
+        country_us = self.env.ref("base.us").id
+        partner = Partner.create(
+            {"name": "Abroad", "vat": "131793917", "country_id": country_us}
+        )
+        with self.assertRaises(ValidationError):
+            partner.write({"country_id": country_do})
+
+        # A mistyped RNC as name isn't copied to the VAT
+        partner = Partner.create({"name": "131793917", "country_id": country_do})
+        self.assertFalse(partner.vat)
@@ -0,0 +1,78 @@
+import os
+import tempfile
+
+from odoo.tests.common import TransactionCase
+
+REGISTRY_HEADER = (
+    "RNC|RAZON SOCIAL|NOMBRE COMERCIAL|ACTIVIDAD|||||FECHA|ESTADO|REGIMEN\n"
+)
+
+
+class RncRegistryTest(TransactionCase):
+    def _write_registry(self, lines):
+        fd, path = tempfile.mkstemp(suffix=".TXT")
+        with os.fdopen(fd, "w", encoding="latin-1") as registry_file:
+            registry_file.write(REGISTRY_HEADER + "".join(lines))
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_001_import_registry_file(self):
+        """
+        Check the registry is imported, refreshed with a new file and looked
+        up by RNC
+        """
+
+        registry = self.env["l10n_do.rnc.registry"]
+        count = registry.import_registry_file(
+            self._write_registry(
+                [
+                    "131793916|ITERATIVO SRL|ITERATIVO|SERVICIOS|||||01/01/2015"
+                    "|ACTIVO|NORMAL\n",
+                    "101001577|EMPRESA CERRADA SA||COMERCIO|||||01/01/1990"
+                    "|DADO DE BAJA|NORMAL\n",
+                ]
+            )
+        )
+        self.assertEqual(count, 2)
+        self.assertEqual(
+            registry.lookup(["131793916"])["131793916"]["name"], "ITERATIVO SRL"
+        )
+
+        registry.import_registry_file(
+            self._write_registry(
+                [
+                    "131793916|ITERATIVO SRL|ITERATIVO|SERVICIOS|||||01/01/2015"
+                    "|SUSPENDIDO|NORMAL\n",
+                ]
+            )
+        )
+        data = registry.lookup(["131793916", "101001577"])
+        self.assertEqual(list(data), ["131793916"])
+        self.assertEqual(data["131793916"]["status"], "SUSPENDIDO")
+
+    def test_002_registry_payer_type(self):
+        """
+        Check partners are classified by the activity of their RNC in the
+        registry before their name keywords
+        """
+
+        self.env["l10n_do.rnc.registry"].import_registry_file(
+            self._write_registry(
+                [
+                    "131793916|ITERATIVO SRL|ITERATIVO|SERVICIOS|||||01/01/2015"
+                    "|ACTIVO|NORMAL\n",
+                    "101001577|AYUNTAMIENTO DEL DISTRITO||ADMINISTRACION PUBLICA"
+                    "|||||01/01/1990|ACTIVO|NORMAL\n",
+                ]
+            )
+        )
+        country_do = self.env.ref("base.do").id
+        partners = self.env["res.partner"].create(
+            [
+                {"name": "Iterativo", "vat": "131793916", "country_id": country_do},
+                {"name": "Ayuntamiento", "vat": "101001577", "country_id": country_do},
+            ]
+        )
+        self.assertEqual(
+            partners.mapped("l10n_do_dgii_tax_payer_type"), ["taxpayer", "governmental"]
+        )
@@ -0,0 +1,123 @@
+import base64
+
+from odoo import tools
+from odoo.tests.common import TransactionCase
+from odoo.modules.module import get_module_resource
+
+
+class VendorBillImportTest(TransactionCase):
+    def setUp(self):
+        super(VendorBillImportTest, self).setUp()
+
+        tools.convert_file(
+            self.cr,
+            "l10n_do_accounting",
+            get_module_resource("account", "test", "account_minimal_test.xml"),
+            {},
+            "init",
+            False,
+            "test",
+            self.registry._assertion_report,
+        )
+        country_do = self.env.ref("base.do").id
+        company = self.env.user.company_id
+        company.write({"vat": "131793916", "country_id": country_do})
+
+        self.journal = self.env["account.journal"].search(
+            [("type", "=", "purchase"), ("company_id", "=", company.id)], limit=1
+        )
+        self.journal.l10n_latam_use_documents = True
+
+        self.partner = self.env["res.partner"].create(
+            {
+                "name": "Vendor",
+                "vat": "101001577",
+                "country_id": country_do,
+                "l10n_do_expense_type": "02",
+            }
+        )
+
+    def test_001_vendor_bill_import(self):
+        """
+        Check bills are created from the rows, taking the expense type of the
+        vendor, and repeated NCF are reported
+        """
+
+        header = "rnc,ncf,date,amount,itbis\n"
+        wizard = self.env["l10n_do.vendor.bill.import"].create(
+            {
+                "journal_id": self.journal.id,
+                "tax_id": False,
+                "data_file": base64.b64encode(header.encode()),
+            }
+        )
+        rows = [
+            {
+                "rnc": "101-00157-7",
+                "ncf": "B0100000001",
+                "date": "20200131",
+                "amount": "1,000.00",
+                "itbis": "",
+            },
+            {
+                "rnc": "101001577",
+                "ncf": "B0100000001",
+                "date": "20200131",
+                "amount": "500",
+                "itbis": "",
+            },
+            {
+                "rnc": "999999999",
+                "ncf": "B0100000002",
+                "date": "20200131",
+                "amount": "500",
+                "itbis": "",
+            },
+        ]
+
+        summary = wizard._import_rows(rows)
+
+        self.assertEqual(summary["rows"], 3)
+        self.assertEqual(len(summary["moves"]), 1)
+        self.assertEqual([line for line, message in summary["errors"]], [3, 4])
+        bill = summary["moves"]
+        self.assertEqual(bill.ref, "B0100000001")
+        self.assertEqual(bill.l10n_do_expense_type, "02")
+        self.assertEqual(bill.amount_untaxed, 1000.0)
+
+    def test_002_vendor_bill_import_formatted_vat(self):
+        """
+        Check vendors whose VAT is stored with separators are found
+        """
+
+        partner = self.env["res.partner"].create(
+            {
+                "name": "Formatted Vendor",
+                "vat": "430-01234-3",
+                "country_id": self.env.ref("base.do").id,
+                "l10n_do_expense_type": "03",
+            }
+        )
+        header = "rnc,ncf,date,amount,itbis\n"
+        wizard = self.env["l10n_do.vendor.bill.import"].create(
+            {
+                "journal_id": self.journal.id,
+                "tax_id": False,
+                "data_file": base64.b64encode(header.encode()),
+            }
+        )
+        rows = [
+            {
+                "rnc": "430012343",
+                "ncf": "B0100000003",
+                "date": "20200131",
+                "amount": "500",
+                "itbis": "",
+            },
+        ]
+
+        summary = wizard._import_rows(rows)
+
+        self.assertFalse(summary["errors"])
+        self.assertEqual(summary["moves"].partner_id, partner)
+        self.assertEqual(summary["moves"].l10n_do_expense_type, "03")
@@ -1,2 +1,4 @@
 from . import account_move_reversal
 from . import account_move_cancel
+from . import vendor_bill_import
+from . import dgii_report
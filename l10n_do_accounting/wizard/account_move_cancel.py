@@ -1,5 +1,4 @@
 from odoo import models, fields, _
-from odoo.exceptions import UserError
 
 
 class AccountMoveCancel(models.TransientModel):
@@ -24,25 +23,23 @@ class AccountMoveCancel(models.TransientModel):
     def move_cancel(self):
         context = dict(self._context or {})
         active_ids = context.get("active_ids", []) or []
-        for invoice in self.env["account.move"].browse(active_ids):
-            if invoice.state == "cancel":
-                raise UserError(
-                    _(
-                        "Selected invoice(s) cannot be cancelled as they are "
-                        "already in 'Cancelled' state."
-                    )
-                )
-            if invoice.invoice_payment_state != "not_paid":
-                raise UserError(
-                    _(
-                        "Selected invoice(s) cannot be cancelled as they are "
-                        "already in 'Paid' state."
-                    )
-                )
-            invoice.write(
-                {
-                    "state": "cancel",
-                    "l10n_do_cancellation_type": self.l10n_do_cancellation_type,
-                }
-            )
-        return {"type": "ir.actions.act_window_close"}
+        invoices = self.env["account.move"].browse(active_ids)
+        summary = invoices._l10n_do_cancel_invoices(self.l10n_do_cancellation_type)
+        if len(invoices) <= 1:
+            return {"type": "ir.actions.act_window_close"}
+
+        return {
+            "type": "ir.actions.act_window",
+            "name": _("%s Cancelled Invoices (%s)")
+            % (
+                summary["count"],
+                ", ".join(
+                    "%s: %s" % (document_type or _("Without document type"), count)
+                    for document_type, count in summary["document_types"].items()
+                ),
+            ),
+            "res_model": "account.move",
+            "view_mode": "tree,form",
+            "domain": [("id", "in", invoices.ids)],
+            "target": "current",
+        }
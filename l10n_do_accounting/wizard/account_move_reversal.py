@@ -1,5 +1,4 @@
 from odoo import models, api, fields, _
-from odoo.exceptions import UserError
 
 
 class AccountMoveReversal(models.TransientModel):
@@ -80,15 +79,8 @@ class AccountMoveReversal(models.TransientModel):
             and move.company_id.l10n_do_country_code == "DO"
         )
 
-        if len(move_ids_use_document) > 1:
-            raise UserError(
-                _(
-                    "You cannot create Credit Notes from multiple "
-                    "documents at a time."
-                )
-            )
         if move_ids_use_document:
-            res["is_ecf_invoice"] = move_ids_use_document[0].is_ecf_invoice
+            res["is_ecf_invoice"] = any(move_ids_use_document.mapped("is_ecf_invoice"))
 
         return res
 
@@ -106,6 +98,22 @@ class AccountMoveReversal(models.TransientModel):
 
     def reverse_moves(self):
 
+        moves = (
+            self.env["account.move"].browse(self.env.context["active_ids"])
+            if self.env.context.get("active_model") == "account.move"
+            else self.move_id
+        )
+        if (
+            len(moves) > 1
+            and self.refund_method in ("refund", "cancel")
+            and all(
+                move.l10n_latam_use_documents
+                and move.company_id.l10n_do_country_code == "DO"
+                for move in moves
+            )
+        ):
+            return self._l10n_do_batch_reverse_moves(moves)
+
         return super(
             AccountMoveReversal,
             self.with_context(
@@ -116,3 +124,23 @@ class AccountMoveReversal(models.TransientModel):
                 l10n_do_ecf_modification_code=self.l10n_do_ecf_modification_code,
             ),
         ).reverse_moves()
+
+    def _l10n_do_batch_reverse_moves(self, moves):
+        """ Issue the credit notes of several fiscal invoices at once """
+        reverse_moves = moves.l10n_do_batch_reverse(
+            refund_type=self.refund_type,
+            percentage=self.percentage,
+            amount=self.amount,
+            reason=self.reason,
+            l10n_do_ecf_modification_code=self.l10n_do_ecf_modification_code,
+            date=self.date,
+            journal=self.journal_id,
+            cancel=self.refund_method == "cancel",
+        )
+        return {
+            "name": _("Reverse Moves"),
+            "type": "ir.actions.act_window",
+            "res_model": "account.move",
+            "view_mode": "tree,form",
+            "domain": [("id", "in", reverse_moves.ids)],
+        }
@@ -0,0 +1,333 @@
+import logging
+import os
+import time
+from functools import partial
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+from odoo.tools import config
+
+from ..models.account_move_line import L10N_DO_ITBIS_AMOUNT_SQL
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+    _logger.debug("Cannot import xlsxwriter, DGII reports can't be exported to XLSX")
+
+# Rows fetched at once from the server-side cursor
+DGII_REPORT_FETCH_SIZE = 2000
+
+# 1: RNC, 2: cédula, 3: other identifiers, blank without one
+DGII_ID_TYPE = """
+    CASE length(COALESCE(partner.vat, ''))
+        WHEN 0 THEN ''
+        WHEN 9 THEN '1'
+        WHEN 11 THEN '2'
+        ELSE '3'
+    END
+"""
+
+DGII_ISSUE_DATE = "to_char(am.invoice_date, 'YYYYMMDD')"
+
+# Columns without data in Odoo: blank dates and codes, zero amounts
+DGII_BLANK = "NULL"
+DGII_ZERO = "0.0"
+
+DGII_SERVICES_AMOUNT = """
+    COALESCE((
+        SELECT SUM(aml.price_subtotal)
+        FROM account_move_line aml
+        JOIN product_product pp ON pp.id = aml.product_id
+        JOIN product_template pt ON pt.id = pp.product_tmpl_id
+        WHERE aml.move_id = am.id
+        AND NOT aml.exclude_from_invoice_tab
+        AND pt.type = 'service'
+    ), 0)
+"""
+
+# {report: (move types, move state, [(column, SQL expression)])}, columns of
+# the DGII TXT submission layouts
+DGII_REPORTS = {
+    "606": (
+        ("in_invoice", "in_refund"),
+        "posted",
+        [
+            ("RNC o Cédula", "partner.vat"),
+            ("Tipo Id", DGII_ID_TYPE),
+            ("Tipo Bienes y Servicios Comprados", "am.l10n_do_expense_type"),
+            ("NCF", "am.ref"),
+            ("NCF o Documento Modificado", "am.l10n_do_origin_ncf"),
+            ("Fecha Comprobante", DGII_ISSUE_DATE),
+            ("Fecha Pago", DGII_BLANK),
+            ("Monto Facturado en Servicios", DGII_SERVICES_AMOUNT),
+            (
+                "Monto Facturado en Bienes",
+                "am.amount_untaxed - %s" % DGII_SERVICES_AMOUNT,
+            ),
+            ("Total Monto Facturado", "am.amount_untaxed"),
+            ("ITBIS Facturado", L10N_DO_ITBIS_AMOUNT_SQL),
+            ("ITBIS Retenido", DGII_ZERO),
+            ("ITBIS sujeto a Proporcionalidad (Art. 349)", DGII_ZERO),
+            ("ITBIS llevado al Costo", DGII_ZERO),
+            ("ITBIS por Adelantar", L10N_DO_ITBIS_AMOUNT_SQL),
+            ("ITBIS percibido en compras", DGII_ZERO),
+            ("Tipo de Retención en ISR", DGII_BLANK),
+            ("Monto Retención Renta", DGII_ZERO),
+            ("ISR Percibido en compras", DGII_ZERO),
+            ("Impuesto Selectivo al Consumo", DGII_ZERO),
+            ("Otros Impuestos/Tasas", DGII_ZERO),
+            ("Monto Propina Legal", DGII_ZERO),
+            ("Forma de Pago", DGII_BLANK),
+        ],
+    ),
+    "607": (
+        ("out_invoice", "out_refund"),
+        "posted",
+        [
+            ("RNC/Cédula o Pasaporte", "partner.vat"),
+            ("Tipo Identificación", DGII_ID_TYPE),
+            ("Número Comprobante Fiscal", "am.ref"),
+            ("Número Comprobante Fiscal Modificado", "am.l10n_do_origin_ncf"),
+            ("Tipo de Ingreso", "am.l10n_do_income_type"),
+            ("Fecha Comprobante", DGII_ISSUE_DATE),
+            ("Fecha de Retención", DGII_BLANK),
+            ("Monto Facturado", "am.amount_untaxed"),
+            ("ITBIS Facturado", L10N_DO_ITBIS_AMOUNT_SQL),
+            ("ITBIS Retenido por Terceros", DGII_ZERO),
+            ("ITBIS Percibido", DGII_ZERO),
+            ("Retención Renta por Terceros", DGII_ZERO),
+            ("ISR Percibido", DGII_ZERO),
+            ("Impuesto Selectivo al Consumo", DGII_ZERO),
+            ("Otros Impuestos/Tasas", DGII_ZERO),
+            ("Monto Propina Legal", DGII_ZERO),
+            ("Efectivo", DGII_ZERO),
+            ("Cheque/Transferencia/Depósito", DGII_ZERO),
+            ("Tarjeta Débito/Crédito", DGII_ZERO),
+            # Payment methods aren't known: what is still due is reported as
+            # sold on credit and what has been paid as other forms of sale
+            ("Venta a Crédito", "am.amount_residual"),
+            ("Bonos o Certificados de Regalo", DGII_ZERO),
+            ("Permuta", DGII_ZERO),
+            ("Otras Formas de Ventas", "am.amount_total - am.amount_residual"),
+        ],
+    ),
+    "608": (
+        ("out_invoice", "out_refund"),
+        "cancel",
+        [
+            ("Número de Comprobante Fiscal", "am.ref"),
+            ("Fecha de Comprobante", DGII_ISSUE_DATE),
+            ("Tipo de Anulación", "am.l10n_do_cancellation_type"),
+        ],
+    ),
+}
+
+
+def remove_dgii_report_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def fetch_dgii_report_rows(cr, query, params):
+    """Yield the rows of a report query in batches. The ORM cursor fetches the
+    whole result at once, so the query runs through a cursor declared on the
+    server, keeping only one batch in memory."""
+    cr.execute("DECLARE l10n_do_dgii_report NO SCROLL CURSOR FOR " + query, params)
+    while True:
+        cr.execute(
+            "FETCH FORWARD %s FROM l10n_do_dgii_report", (DGII_REPORT_FETCH_SIZE,)
+        )
+        rows = cr.fetchall()
+        if not rows:
+            break
+        yield from rows
+    cr.execute("CLOSE l10n_do_dgii_report")
+
+
+def format_dgii_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return "%.2f" % value
+    return str(value)
+
+
+class DgiiReport(models.TransientModel):
+    """
+    Generate the monthly DGII 606 (purchases), 607 (sales) and 608
+    (cancellations) reports. Fiscal moves are read through a server-side cursor
+    and written straight to a file in the filestore, which is downloaded from
+    /l10n_do_accounting/dgii_report/<id>, so memory doesn't depend on how many
+    invoices the company issues.
+    """
+
+    _name = "l10n_do.dgii.report"
+    _description = "DGII Report"
+
+    company_id = fields.Many2one(
+        "res.company",
+        required=True,
+        default=lambda self: self.env.company,
+    )
+    report_type = fields.Selection(
+        selection=[
+            ("606", "606 - Purchases"),
+            ("607", "607 - Sales"),
+            ("608", "608 - Cancellations"),
+        ],
+        required=True,
+        default="607",
+    )
+    date_from = fields.Date(
+        string="From",
+        required=True,
+        default=lambda self: fields.Date.start_of(
+            fields.Date.subtract(fields.Date.today(), months=1), "month"
+        ),
+    )
+    date_to = fields.Date(
+        string="To",
+        required=True,
+        default=lambda self: fields.Date.end_of(
+            fields.Date.subtract(fields.Date.today(), months=1), "month"
+        ),
+    )
+    file_format = fields.Selection(
+        selection=[("txt", "TXT"), ("xlsx", "XLSX")],
+        required=True,
+        default="txt",
+    )
+    state = fields.Selection(
+        selection=[("draft", "Draft"), ("done", "Done")],
+        default="draft",
+    )
+    filename = fields.Char(readonly=True)
+
+    def _get_report_path(self):
+        """Return the path of the generated file, which is removed along with
+        the wizard"""
+        self.ensure_one()
+        return os.path.join(
+            config.filestore(self.env.cr.dbname),
+            "l10n_do_dgii_reports",
+            "%s.%s" % (self.id, self.file_format),
+        )
+
+    def action_generate(self):
+        self.ensure_one()
+        path = self._get_report_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.env.cr.after("rollback", partial(remove_dgii_report_file, path))
+        with open(path, "wb") as fileobj:
+            self._write_report(fileobj)
+        self.write(
+            {
+                "state": "done",
+                "filename": "DGII_F_%s_%s_%s.%s"
+                % (
+                    self.report_type,
+                    self.company_id.vat or "",
+                    self.date_from.strftime("%Y%m"),
+                    self.file_format,
+                ),
+            }
+        )
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
+
+    def action_download(self):
+        self.ensure_one()
+        return {
+            "type": "ir.actions.act_url",
+            "url": "/l10n_do_accounting/dgii_report/%s" % self.id,
+            "target": "self",
+        }
+
+    def unlink(self):
+        paths = [report._get_report_path() for report in self]
+        res = super(DgiiReport, self).unlink()
+        for path in paths:
+            self.env.cr.after("commit", partial(remove_dgii_report_file, path))
+        return res
+
+    def _get_report_query(self):
+        """Return the query of the report rows, its count query and their
+        parameters"""
+        move_types, state, columns = DGII_REPORTS[self.report_type]
+        from_clause = """
+            FROM account_move am
+            JOIN account_journal aj ON aj.id = am.journal_id
+            LEFT JOIN res_partner partner ON partner.id = am.commercial_partner_id
+            WHERE am.company_id = %(company_id)s
+            AND aj.l10n_latam_use_documents
+            AND am.type IN %(move_types)s
+            AND am.state = %(state)s
+            AND am.invoice_date BETWEEN %(date_from)s AND %(date_to)s
+        """
+        query = "SELECT %s %s ORDER BY am.invoice_date, am.id" % (
+            ", ".join(expression for column, expression in columns),
+            from_clause,
+        )
+        params = {
+            "company_id": self.company_id.id,
+            "move_types": move_types,
+            "state": state,
+            "date_from": self.date_from,
+            "date_to": self.date_to,
+            "itbis_group_id": self.env.ref("l10n_do.group_itbis").id,
+        }
+        return query, "SELECT COUNT(*) %s" % from_clause, params
+
+    def _write_report(self, fileobj):
+        """Write the report to a binary file object, i.e. a file on disk"""
+        self.ensure_one()
+        if self.file_format == "xlsx" and not xlsxwriter:
+            raise UserError(_("The xlsxwriter library is required for XLSX files"))
+
+        query, count_query, params = self._get_report_query()
+        columns = DGII_REPORTS[self.report_type][2]
+        self.env["account.move"].flush()
+        self.env["account.move.line"].flush()
+        self.env.cr.execute(count_query, params)
+        count = self.env.cr.fetchone()[0]
+
+        start = time.time()
+        workbook = sheet = None
+        if self.file_format == "xlsx":
+            workbook = xlsxwriter.Workbook(fileobj, {"constant_memory": True})
+            sheet = workbook.add_worksheet(self.report_type)
+            sheet.write_row(0, 0, [column for column, expression in columns])
+        else:
+            header = "%s|%s|%s|%s\n" % (
+                self.report_type,
+                self.company_id.vat or "",
+                self.date_from.strftime("%Y%m"),
+                count,
+            )
+            fileobj.write(header.encode())
+
+        rows = fetch_dgii_report_rows(self.env.cr, query, params)
+        for index, row in enumerate(rows, 1):
+            if sheet:
+                sheet.write_row(index, 0, row)
+            else:
+                line = "|".join(format_dgii_value(value) for value in row)
+                fileobj.write((line + "\n").encode())
+
+        if workbook:
+            workbook.close()
+        _logger.info(
+            "DGII %s report of %s with %s rows written in %.2fs"
+            % (self.report_type, self.company_id.name, count, time.time() - start)
+        )
+        return count
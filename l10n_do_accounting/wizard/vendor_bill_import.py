@@ -0,0 +1,331 @@
+import base64
+import csv
+import io
+import logging
+import time
+from datetime import datetime
+
+import psycopg2
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import float_compare, split_every
+
+from ..models.res_partner import VAT_NORMALIZED_SQL, VAT_SEPARATORS_RE
+
+_logger = logging.getLogger(__name__)
+
+# Rows created with a single create()
+VENDOR_BILL_IMPORT_CHUNK_SIZE = 1000
+
+
+def parse_vendor_bill_date(value):
+    """606 dates are YYYYMMDD, also accept YYYY-MM-DD"""
+    value = (value or "").strip()
+    if len(value) == 8 and value.isdigit():
+        return datetime.strptime(value, "%Y%m%d").date()
+    return fields.Date.to_date(value)
+
+
+def parse_vendor_bill_amount(value):
+    return float((value or "0").strip().replace(",", "") or 0)
+
+
+class VendorBillImport(models.TransientModel):
+    """
+    Import vendor bills from a 606-style CSV file whose header has the columns
+    rnc, ncf, date, amount (untaxed), itbis and, optionally, expense_type.
+    The file is read in chunks, partners are resolved by VAT, the document
+    type is taken from the NCF prefix and bills already registered are
+    skipped, so large files don't go through the invoice form one by one.
+    """
+
+    _name = "l10n_do.vendor.bill.import"
+    _description = "Import Vendor Bills"
+
+    journal_id = fields.Many2one(
+        "account.journal",
+        string="Journal",
+        required=True,
+        domain="[('type', '=', 'purchase'), ('l10n_latam_use_documents', '=', True)]",
+    )
+    tax_id = fields.Many2one(
+        "account.tax",
+        string="ITBIS Tax",
+        domain="[('type_tax_use', '=', 'purchase')]",
+        default=lambda self: self.env.company.account_purchase_tax_id,
+        help="Tax of the bills with ITBIS",
+    )
+    data_file = fields.Binary(string="File", required=True)
+    filename = fields.Char()
+    state = fields.Selection(
+        selection=[("draft", "Draft"), ("done", "Done")],
+        default="draft",
+    )
+    result = fields.Text(readonly=True)
+    move_ids = fields.Many2many("account.move", string="Vendor Bills", readonly=True)
+
+    def action_import(self):
+        self.ensure_one()
+        stream = io.TextIOWrapper(
+            io.BytesIO(base64.b64decode(self.data_file)), encoding="utf-8-sig"
+        )
+        summary = self._import_rows(csv.DictReader(stream))
+
+        lines = [
+            _("%s rows read, %s vendor bills created in %.2fs (%.0f rows/s)")
+            % (
+                summary["rows"],
+                len(summary["moves"]),
+                summary["duration"],
+                summary["rows"] / summary["duration"] if summary["duration"] else 0,
+            )
+        ]
+        lines.extend(
+            _("Line %s: %s") % (line, message) for line, message in summary["errors"]
+        )
+        self.write(
+            {
+                "state": "done",
+                "result": "\n".join(lines),
+                "move_ids": [(6, 0, summary["moves"].ids)],
+            }
+        )
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
+
+    def action_open_moves(self):
+        self.ensure_one()
+        return {
+            "name": _("Vendor Bills"),
+            "type": "ir.actions.act_window",
+            "res_model": "account.move",
+            "view_mode": "tree,form",
+            "domain": [("id", "in", self.move_ids.ids)],
+        }
+
+    def _import_rows(self, rows, chunk_size=None):
+        """
+        :param rows: iterable of dicts, i.e. a csv.DictReader
+        :return: dict with the rows read, the created bills, the (line, message)
+        errors and the duration
+        """
+        self.ensure_one()
+        chunk_size = chunk_size or VENDOR_BILL_IMPORT_CHUNK_SIZE
+        start = time.time()
+        summary = {"rows": 0, "moves": self.env["account.move"], "errors": []}
+        # VAT index shared by every chunk: {vat: (partner id, expense type)}
+        partner_index = {}
+        seen = set()
+
+        # Line 1 is the header
+        for chunk in split_every(chunk_size, enumerate(rows, 2)):
+            chunk_start = time.time()
+            vals_list, lines, errors = self._prepare_chunk(chunk, partner_index, seen)
+            moves, create_errors = self._create_chunk(vals_list, lines)
+            summary["rows"] += len(chunk)
+            summary["moves"] |= moves
+            summary["errors"].extend(errors + create_errors)
+            duration = time.time() - chunk_start
+            _logger.info(
+                "Imported %s vendor bills out of %s rows in %.2fs (%.0f rows/s)"
+                % (len(moves), len(chunk), duration, len(chunk) / (duration or 1))
+            )
+
+        summary["errors"].sort()
+        summary["duration"] = time.time() - start
+        return summary
+
+    def _prepare_chunk(self, chunk, partner_index, seen):
+        """Return the values of the bills of a chunk of (line, row), their
+        lines and the (line, message) errors of the rows that can't be imported"""
+        company = self.journal_id.company_id
+        document_types = self._get_document_types()
+        errors = []
+
+        DocumentType = self.env["l10n_latam.document.type"]
+        ncf_results = DocumentType.l10n_do_normalize_ncf_numbers(
+            [row.get("ncf") for line, row in chunk]
+        )
+        vat_results = self.env["res.partner"].l10n_do_validate_vats(
+            [row.get("rnc") for line, row in chunk]
+        )
+        vats = {vat for vat, vat_error in vat_results if vat}
+        self._index_partners(vats - set(partner_index), partner_index)
+
+        parsed = []
+        for (line, row), (ncf, ncf_error), (vat, vat_error) in zip(
+            chunk, ncf_results, vat_results
+        ):
+            try:
+                if vat_error:
+                    raise UserError(vat_error)
+                if ncf_error:
+                    raise UserError(ncf_error)
+                if vat not in partner_index:
+                    raise UserError(_("There is no partner with RNC %s") % (vat or ""))
+                if ncf[:3] not in document_types:
+                    raise UserError(_("There is no document type for NCF %s") % ncf)
+                partner_id, expense_type = partner_index[vat]
+                if (partner_id, ncf) in seen:
+                    raise UserError(_("NCF %s is repeated in the file") % ncf)
+                parsed.append(
+                    (
+                        line,
+                        partner_id,
+                        ncf,
+                        parse_vendor_bill_date(row.get("date")),
+                        parse_vendor_bill_amount(row.get("amount")),
+                        parse_vendor_bill_amount(row.get("itbis")),
+                        (row.get("expense_type") or "").strip().zfill(2)
+                        if row.get("expense_type")
+                        else expense_type,
+                    )
+                )
+                seen.add((partner_id, ncf))
+            except (UserError, ValueError) as e:
+                errors.append((line, e.args[0] if e.args else str(e)))
+
+        existing = self._get_existing_bills(company, parsed)
+        vals_list, lines = [], []
+        for line, partner_id, ncf, date, amount, itbis, expense_type in parsed:
+            if (partner_id, ncf) in existing:
+                errors.append((line, _("NCF %s is already registered") % ncf))
+                continue
+            try:
+                vals_list.append(
+                    self._prepare_move_vals(
+                        partner_id,
+                        ncf,
+                        document_types[ncf[:3]],
+                        date,
+                        amount,
+                        itbis,
+                        expense_type,
+                    )
+                )
+                lines.append(line)
+            except UserError as e:
+                errors.append((line, e.args[0]))
+        return vals_list, lines, errors
+
+    @api.model
+    def _get_document_types(self):
+        document_types = self.env["l10n_latam.document.type"].search(
+            [("country_id", "=", self.env.ref("base.do").id)]
+        )
+        return {dt.doc_code_prefix: dt.id for dt in document_types}
+
+    def _index_partners(self, vats, partner_index):
+        """Add the partners with these VAT to the index. Stored VAT are
+        compared without separators, as the ones of the file."""
+        if not vats:
+            return
+        company = self.journal_id.company_id
+        self.env["res.partner"].flush(["vat"])
+        self.env.cr.execute(
+            "SELECT id FROM res_partner WHERE {vat} IN %s;".format(
+                vat=VAT_NORMALIZED_SQL
+            ),
+            (tuple(vats),),
+        )
+        partners = self.env["res.partner"].search_read(
+            [
+                ("id", "in", [row[0] for row in self.env.cr.fetchall()]),
+                ("parent_id", "=", False),
+                ("company_id", "in", [company.id, False]),
+            ],
+            ["vat", "l10n_do_expense_type"],
+            order="id",
+        )
+        for partner in partners:
+            partner_index.setdefault(
+                VAT_SEPARATORS_RE.sub("", partner["vat"]),
+                (partner["id"], partner["l10n_do_expense_type"]),
+            )
+
+    def _get_existing_bills(self, company, parsed):
+        """Return the (partner id, NCF) of the parsed rows already registered"""
+        keys = tuple((row[1], row[2]) for row in parsed)
+        if not keys:
+            return set()
+        self.env["account.move"].flush(["commercial_partner_id", "ref", "type"])
+        self.env.cr.execute(
+            """
+            SELECT commercial_partner_id, ref
+            FROM account_move
+            WHERE company_id = %s
+            AND type = 'in_invoice'
+            AND (commercial_partner_id, ref) IN %s;
+            """,
+            (company.id, keys),
+        )
+        return set(self.env.cr.fetchall())
+
+    def _prepare_move_vals(
+        self, partner_id, ncf, document_type_id, date, amount, itbis, expense_type
+    ):
+        tax = self.tax_id
+        if itbis:
+            if not tax:
+                raise UserError(_("Set the ITBIS tax to import bills with ITBIS"))
+            if tax.amount_type == "percent" and float_compare(
+                amount * tax.amount / 100,
+                itbis,
+                precision_rounding=1.0,
+            ):
+                raise UserError(
+                    _("ITBIS %s doesn't match the tax %s") % (itbis, tax.name)
+                )
+        return {
+            "type": "in_invoice",
+            "journal_id": self.journal_id.id,
+            "partner_id": partner_id,
+            "invoice_date": date,
+            "l10n_latam_document_type_id": document_type_id,
+            "ref": ncf,
+            "l10n_do_expense_type": expense_type,
+            "invoice_line_ids": [
+                (
+                    0,
+                    0,
+                    {
+                        "name": ncf,
+                        "account_id": self.journal_id.default_debit_account_id.id,
+                        "quantity": 1,
+                        "price_unit": amount,
+                        "tax_ids": [(6, 0, tax.ids if itbis else [])],
+                    },
+                )
+            ],
+        }
+
+    def _create_chunk(self, vals_list, lines):
+        """Create the bills of a chunk at once. If that fails they are created
+        one by one to report the rows that can't be imported."""
+        AccountMove = self.env["account.move"]
+        if not vals_list:
+            return AccountMove, []
+        try:
+            with self.env.cr.savepoint():
+                moves = AccountMove.create(vals_list)
+                moves.flush()
+            return moves, []
+        except (UserError, ValidationError, psycopg2.IntegrityError):
+            _logger.info("Chunk of vendor bills failed, importing it row by row")
+
+        moves, errors = AccountMove, []
+        for line, vals in zip(lines, vals_list):
+            try:
+                with self.env.cr.savepoint():
+                    move = AccountMove.create(vals)
+                    move.flush()
+                moves |= move
+            except (UserError, ValidationError, psycopg2.IntegrityError) as e:
+                errors.append((line, e.args[0] if e.args else str(e)))
+        return moves, errors